@@ -0,0 +1,48 @@
+# Peak memory of decoding a 1024x1024 Titan image response, the old way (read the whole body,
+# json.loads it, b64decode the string) against the streaming decode in code_gen_image/image_decode.py.
+# The stand-in image is random pixels, so it doesn't compress (about 3 MB of PNG, 4 MB of base64),
+# which is the worst case; measured with tracemalloc, so only Python allocations count.
+#
+# Usage (from the bedrock-api folder):
+#   python benchmarks/image_memory.py [width height]
+import base64, io, json, os, struct, sys, tracemalloc, zlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(here), "code_gen_image"))
+from image_decode import iter_image_bytes
+
+width, height = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) > 2 else (1024, 1024)
+
+
+def make_png(width, height):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    raw = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+
+
+def whole_body(body):
+    response_body = json.loads(body.read())
+    base64_image = response_body.get("images")[0]
+    return base64.b64decode(base64_image)
+
+
+def streaming(body):
+    png = io.BytesIO()
+    for data in iter_image_bytes(body):
+        png.write(data)
+    return png.getvalue()
+
+
+png = make_png(width, height)
+response = json.dumps({"images": [base64.b64encode(png).decode()], "error": None}).encode()
+print(f"{width}x{height}: PNG {len(png) / 2**20:.2f} MB, response body {len(response) / 2**20:.2f} MB")
+
+for name, decode in [("json.loads", whole_body), ("streaming", streaming)]:
+    body = io.BytesIO(response)     # stands in for the HTTP connection
+    tracemalloc.start()
+    assert decode(body) == png
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:12} peak {peak / 2**20:6.2f} MB  ({peak / len(png):.1f}x the PNG)")
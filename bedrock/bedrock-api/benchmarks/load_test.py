@@ -0,0 +1,89 @@
+# Load test for the bedrock-api handlers against the local Bedrock emulator (../bedrock_emulator.py),
+# so it costs nothing and runs without AWS access.  Each function's lambda_handler is called
+# `--requests` times from `--concurrency` threads in a fresh interpreter, and the script reports:
+#   rps            - handler calls completed per second
+#   p50/p95/p99_ms - handler latency percentiles
+#   errors         - calls that raised or returned a non-200 status
+#
+# Usage (from the bedrock-api folder):
+#   python benchmarks/load_test.py --requests 200 --concurrency 16 --latency-median 0.3 --throttle-rate 0.05
+#   python benchmarks/load_test.py --endpoint http://localhost:8123 code_gen_text
+import argparse, json, os, subprocess, sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, os.path.dirname(root))
+from bedrock_emulator import EmulatorSettings, start_emulator
+
+events = {
+    "code_gen_text": {"queryStringParameters": {"prompt": "What are the top 3 recommended European vacation destinations?"}},
+    "code_gen_image": {"queryStringParameters": {"prompt": "picture of two happy golden retrievers playing tug-o-war"}},
+}
+
+# Runs inside a fresh python process for each function; the handlers' own logging goes to /dev/null:
+probe = """
+import contextlib, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+requests, concurrency, event = int(sys.argv[1]), int(sys.argv[2]), json.loads(sys.argv[3])
+import app
+
+def one(_):
+    start = time.perf_counter()
+    try:
+        ok = app.lambda_handler(event, None).get("statusCode") == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+latencies = sorted(seconds for seconds, _ in results)
+pick = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+print(json.dumps({
+    "rps": round(requests / elapsed, 1),
+    "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+    "errors": sum(not ok for _, ok in results),
+}))
+"""
+
+parser = argparse.ArgumentParser(description="Load test the bedrock-api handlers against the Bedrock emulator")
+parser.add_argument("functions", nargs="*", default=list(events))
+parser.add_argument("--requests", type=int, default=100)
+parser.add_argument("--concurrency", type=int, default=8)
+parser.add_argument("--endpoint", help="use an emulator that's already running instead of starting one")
+parser.add_argument("--latency-median", type=float, default=0.2)
+parser.add_argument("--latency-sigma", type=float, default=0.4)
+parser.add_argument("--chunk-delay", type=float, default=0.005)
+parser.add_argument("--throttle-rate", type=float, default=0.0)
+parser.add_argument("--max-concurrency", type=int, default=0)
+args = parser.parse_args()
+
+endpoint = args.endpoint
+if not endpoint:
+    server = start_emulator(settings=EmulatorSettings(args.latency_median, args.latency_sigma, args.chunk_delay,
+                                                      args.throttle_rate, args.max_concurrency))
+    endpoint = server.url
+
+for function in args.functions:
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([os.path.join(root, function), os.path.join(root, "shared")]),
+               AWS_ENDPOINT_URL_BEDROCK_RUNTIME=endpoint,
+               BEDROCK_MAX_POOL=str(max(10, args.concurrency)))
+    # The emulator doesn't check signatures, but botocore still wants something to sign with:
+    env.setdefault("AWS_ACCESS_KEY_ID", "emulator")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "emulator")
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    # Every request is for the same prompt, so the text and image caches would answer all but the first:
+    env.setdefault("BEDROCK_CACHE_SIZE", "0")
+    env.setdefault("IMAGE_CACHE_MAX_MB", "0")
+    command = [sys.executable, "-c", probe, str(args.requests), str(args.concurrency), json.dumps(events[function])]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode:
+        print(f"{function:16} failed: {result.stderr.strip().splitlines()[-1]}")
+        continue
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"{function:16} " + "  ".join(f"{name}={value}" for name, value in stats.items()))
@@ -0,0 +1,39 @@
+# Measures what a cold start costs each bedrock-api function, without calling any models:
+#   import_ms       - importing app.py in a fresh interpreter (includes building its clients)
+#   first_prime_ms  - first request on the new client (DNS + TCP + TLS handshake)
+#   second_prime_ms - the same request again, on the kept-alive connection
+#
+# Usage (from the bedrock-api folder, with AWS credentials/region configured):
+#   python benchmarks/startup.py [code_gen_text code_gen_image ...]
+import json, os, subprocess, sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+functions = sys.argv[1:] or ["code_gen_text", "code_gen_image", "code_gen_text_knowledge"]
+
+# Runs inside a fresh python process for each function, so nothing is imported yet:
+probe = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+from bedrock_startup import prime
+prime(app.client)
+primed = time.perf_counter()
+prime(app.client)
+again = time.perf_counter()
+print(json.dumps({
+    "import_ms": round((imported - start) * 1000, 1),
+    "first_prime_ms": round((primed - imported) * 1000, 1),
+    "second_prime_ms": round((again - primed) * 1000, 1),
+}))
+"""
+
+for function in functions:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(root, function), os.path.join(root, "shared")]))
+    result = subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True)
+    if result.returncode:
+        print(f"{function:28} failed: {result.stderr.strip().splitlines()[-1]}")
+        continue
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"{function:28} " + "  ".join(f"{name}={value}" for name, value in timings.items()))
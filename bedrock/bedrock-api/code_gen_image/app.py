@@ -1,9 +1,69 @@
-import boto3, json, base64
+import io, json, base64, os, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
 
+from bedrock_metrics import PhaseTimer, init_timer, emit_metrics
+from bedrock_startup import get_client, is_warmup, warm_up
+from image_cache import ImageCache, DiskTier, S3Tier, image_key, etag_for, not_modified
+from transcode import tiers, content_types, choose_format, rendition, transcode
+from image_decode import iter_image_bytes
 
-def call_bedrock(prompt):
-    client = boto3.client('bedrock-runtime')
-    ModelId="amazon.titan-image-generator-v1"
+# Built once per container; image generation can take a while, so allow a long read:
+with init_timer.phase('client'):
+    client = get_client('bedrock-runtime', read_timeout=110)
+ModelId="amazon.titan-image-generator-v1"
+default_config = dict(seed=0, cfg_scale=8, width=512, height=512, quality="standard")
+
+# The only widths x heights Titan Image Generator v1 accepts; anything else is a ValidationException:
+supported_sizes = {
+    (1024, 1024), (768, 768), (512, 512),
+    (768, 1152), (384, 576), (1152, 768), (576, 384), (768, 1280), (384, 640), (1280, 768), (640, 384),
+    (896, 1152), (448, 576), (1152, 896), (576, 448), (768, 1408), (384, 704), (1408, 768), (704, 384),
+    (640, 1408), (320, 704), (1408, 640), (704, 320), (1152, 640), (1173, 640),
+}
+
+# Generated images are cached in /tmp (IMAGE_CACHE_MAX_MB, 0 turns it off) and,
+# if IMAGE_CACHE_BUCKET is set, in S3 for every container to share:
+def make_cache():
+    max_mb = int(os.environ.get('IMAGE_CACHE_MAX_MB', '256'))
+    disk = DiskTier(os.environ.get('IMAGE_CACHE_DIR', '/tmp/image-cache'), max_mb * 1024 * 1024) if max_mb else None
+    s3 = S3Tier(os.environ['IMAGE_CACHE_BUCKET']) if os.environ.get('IMAGE_CACHE_BUCKET') else None
+    return ImageCache(disk, s3)
+
+with init_timer.phase('cache'):
+    cache = make_cache()
+
+# ?seeds=1,2,3&sizes=512x512,1024x1024 asks for every seed at every size, generated
+# IMAGE_VARIANT_CONCURRENCY at a time, up to IMAGE_MAX_VARIANTS images per request:
+variant_concurrency = int(os.environ.get('IMAGE_VARIANT_CONCURRENCY', '4'))
+max_variants = int(os.environ.get('IMAGE_MAX_VARIANTS', '8'))
+
+# ?size=thumbnail|medium|full, in WebP or JPEG when the Accept header lists them (transcode.py).
+# With a cache tier on, a newly generated image's other renditions are made on this thread
+# after the response, so later requests for them are cache hits.  (Lambda pauses the thread
+# between invocations; it picks up where it left off on the next one.)
+background = ThreadPoolExecutor(max_workers=1)
+
+# ?progressive=1 answers right away with a quick IMAGE_PREVIEW_SIZE preview and a job token,
+# while the IMAGE_PROGRESSIVE_SIZE image is generated; ?job=<token> then serves it once it's in
+# the cache.  Both are squares Titan supports, and 512 is the smallest of those.
+preview_size = int(os.environ.get('IMAGE_PREVIEW_SIZE', '512'))
+progressive_size = int(os.environ.get('IMAGE_PROGRESSIVE_SIZE', '1024'))
+for size in (preview_size, progressive_size):
+    if (size, size) not in supported_sizes:
+        raise ValueError(f"{size}x{size} isn't an image size Titan supports")
+if preview_size >= progressive_size:
+    raise ValueError("IMAGE_PREVIEW_SIZE has to be smaller than IMAGE_PROGRESSIVE_SIZE")
+progressive_config = dict(default_config, width=progressive_size, height=progressive_size)
+
+# Full-size renders this container has started, key -> when, so a burst of progressive requests
+# for the same image starts one render.  An asynchronous invocation's finish isn't seen from here,
+# so after IMAGE_RENDER_TIMEOUT seconds (it may have failed) the next request starts another.
+rendering = {}
+rendering_lock = threading.Lock()
+render_timeout = float(os.environ.get('IMAGE_RENDER_TIMEOUT', '120'))
+
+
+def invoke_image(prompt, timer, seed=0, cfg_scale=8, width=512, height=512, quality="standard"):
 
     # Note that the input for the body depends on the selected model
     body = { 
@@ -12,46 +72,292 @@ def call_bedrock(prompt):
             },
         "taskType": "TEXT_IMAGE",
         "imageGenerationConfig":{
-            "cfgScale":8,
-            "seed":0,
-            "quality":"standard",
-            "width":512,
-            "height":512,
+            "cfgScale":cfg_scale,
+            "seed":seed,
+            "quality":quality,
+            "width":width,
+            "height":height,
             "numberOfImages":1
         }
     }
 
+    with timer.phase('serialize'):
+        body = json.dumps(body)
+
     # There is also a streaming option
-    response = client.invoke_model(
-        modelId=ModelId,
-        body=json.dumps(body)  
-    )
+    with timer.phase('invoke'):
+        response = client.invoke_model(
+            modelId=ModelId,
+            body=body
+        )
 
     print(response)
-    response_body = json.loads(response.get("body").read())
+    return response
+
+
+def call_bedrock(prompt, timer=None, **config):
+    timer = timer or PhaseTimer()
+    response = invoke_image(prompt, timer, **config)
+
+    with timer.phase('read'):
+        raw = response.get("body").read()
+    with timer.phase('parse'):
+        response_body = json.loads(raw)
 
     # The returned bytes are base64 encoded:
     base64_image = response_body.get("images")[0]
     return base64_image
 
 
+def generate_png(prompt, timer=None, **config):
+    # Like call_bedrock, but the base64 in the response is decoded as it streams in, so the
+    # whole JSON body and the base64 string are never in memory at once (image_decode.py):
+    timer = timer or PhaseTimer()
+    response = invoke_image(prompt, timer, **config)
+    png = io.BytesIO()
+    for data in iter_image_bytes(response.get("body"), timer=timer):
+        png.write(data)
+    return png.getvalue()
+
+
+def cached_image(prompt, timer=None, **config):
+    # Returns (key, png bytes, whether it came from the cache), generating the image on a miss
+    timer = timer or PhaseTimer()
+    key = image_key(ModelId, prompt, **config)
+    with timer.phase('cache_get'):
+        image = cache.get(key)
+    if image is not None:
+        return key, image, True
+    image = generate_png(prompt, timer, **config)
+    with timer.phase('cache_put'):
+        cache.put(key, image)
+    return key, image, False
+
+
+def rendition_key(key, tier, image_format):
+    # The original PNG is stored under the image's own key, the renditions next to it:
+    return key if (tier, image_format) == ("full", "png") else f"{key}-{tier}.{image_format}"
+
+
+def prerender(key, png, done):
+    for tier in tiers:
+        for image_format in ("webp", "jpeg"):
+            if (tier, image_format) != done:
+                cache.put(rendition_key(key, tier, image_format), transcode(png, tier, image_format),
+                          content_types[image_format])
+
+
+def start_render(key, prompt, config):
+    # In Lambda, the full-size image is made by an asynchronous invocation of this same function
+    # (a background thread would be paused as soon as we return), and lands in the S3 tier where
+    # any container can serve the poll.  Without S3, or outside Lambda, the background thread does it.
+    now = time.monotonic()
+    with rendering_lock:
+        if key in rendering and now - rendering[key] < render_timeout:
+            return
+        rendering[key] = now
+    try:
+        function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+        if function_name and cache.s3:
+            get_client('lambda').invoke(
+                FunctionName=function_name,
+                InvocationType='Event',
+                Payload=json.dumps({"render": {"prompt": prompt, "config": config}}))
+        else:
+            future = background.submit(cached_image, prompt, **config)
+            future.add_done_callback(lambda f: finish_render(key))
+    except Exception:
+        finish_render(key)
+        raise
+
+
+def finish_render(key):
+    with rendering_lock:
+        rendering.pop(key, None)
+
+
+def progressive_handler(prompt):
+    key = image_key(ModelId, prompt, **progressive_config)
+    timer = PhaseTimer()
+    with timer.phase('total'):
+        with timer.phase('cache_get'):
+            image = cache.get(key)
+        # With no cache tier there'd be nowhere for the poll to find the full image, so make it now:
+        if image is None and not (cache.disk or cache.s3):
+            _, image, _ = cached_image(prompt, timer, **progressive_config)
+        pending = image is None
+        config = progressive_config
+        if pending:
+            # Smaller images are quicker to make; quality is already "standard", the fast setting
+            config = dict(progressive_config, width=preview_size, height=preview_size)
+            _, image, _ = cached_image(prompt, timer, **config)
+            start_render(key, prompt, progressive_config)
+    emit_metrics(timer)
+
+    # 202 while the full-size image is still on its way; a client that never sees it
+    # complete (the generation failed) should stop polling after a minute or two.
+    return {
+        'statusCode': 202 if pending else 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            "job": key,
+            "poll": f"/image?job={key}",
+            "status": "PENDING" if pending else "COMPLETE",
+            "width": config['width'],
+            "height": config['height'],
+            "image": base64.b64encode(image).decode('ascii'),
+        }),
+    }
+
+
+def poll_handler(key, event):
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        return {'statusCode': 400, 'body': json.dumps({"error": "not a job token"})}
+    headers = {'Content-Type': 'image/png', 'ETag': etag_for(key), 'Cache-Control': 'public, max-age=31536000, immutable'}
+    if not_modified(event.get('headers'), headers['ETag']):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    image = cache.get(key)
+    if image is None:
+        return {'statusCode': 202, 'headers': {'Content-Type': 'application/json', 'Retry-After': '2'},
+                'body': json.dumps({"job": key, "status": "PENDING"})}
+    headers['Content-Length'] = str(len(image))
+    return {'statusCode': 200, 'headers': headers, 'body': base64.b64encode(image).decode('ascii'), 'isBase64Encoded': True}
+
+
+def parse_variants(query_parameters):
+    seeds = [int(seed) for seed in query_parameters.get('seeds', str(default_config['seed'])).split(',')]
+    sizes = []
+    for size in query_parameters.get('sizes', '512x512').split(','):
+        match = re.fullmatch(r'(\d+)x(\d+)', size.strip().lower())
+        if not match:
+            raise ValueError(f"sizes look like 512x512, not {size!r}")
+        if (int(match.group(1)), int(match.group(2))) not in supported_sizes:
+            raise ValueError(f"{size.strip()} isn't an image size Titan supports")
+        sizes.append((int(match.group(1)), int(match.group(2))))
+    variants = [dict(default_config, seed=seed, width=width, height=height) for seed in seeds for width, height in sizes]
+    if len(variants) > max_variants:
+        raise ValueError(f"at most {max_variants} variants per request, not {len(variants)}")
+    return variants
+
+
+def variants_handler(prompt, query_parameters):
+    try:
+        variants = parse_variants(query_parameters)
+    except ValueError as e:
+        return {'statusCode': 400, 'body': json.dumps({"error": str(e)})}
+
+    def generate(config):
+        start = time.perf_counter()
+        try:
+            key, image, hit = cached_image(prompt, **config)
+        except Exception as e:
+            return dict(config, error=str(e), latency_ms=round((time.perf_counter() - start) * 1000, 1)), None
+        return dict(config, etag=etag_for(key), cache='HIT' if hit else 'MISS',
+                    latency_ms=round((time.perf_counter() - start) * 1000, 1)), (key, image)
+
+    timer = PhaseTimer()
+    with timer.phase('total'):
+        with ThreadPoolExecutor(max_workers=min(variant_concurrency, len(variants))) as pool:
+            results = list(pool.map(generate, variants))
+    timer.count('variants', len(variants))
+    emit_metrics(timer)
+
+    # With the S3 tier on, the manifest links to each image (presigned, so the bucket stays private);
+    # otherwise, or with ?bundle=1, the images come back inline as base64:
+    inline = cache.s3 is None or query_parameters.get('bundle') == '1'
+    manifest = []
+    for variant, generated in results:
+        if generated:
+            key, image = generated
+            if inline:
+                variant['image'] = base64.b64encode(image).decode('ascii')
+            else:
+                variant['url'] = cache.s3.url(key)
+        manifest.append(variant)
+
+    # How much the fan-out saved: the variants' latencies added up, against the wall clock time
+    serial_ms = sum(variant['latency_ms'] for variant in manifest)
+    wall_ms = timer.phases['total']
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({
+            "prompt": prompt,
+            "variants": manifest,
+            "wall_ms": round(wall_ms, 1),
+            "serial_ms": round(serial_ms, 1),
+            "speedup": round(serial_ms / wall_ms, 2) if wall_ms else None,
+        }),
+    }
+
+
 def lambda_handler(event, context):
 
     #print("Received event: " + json.dumps(event, indent=2))
 
+    if is_warmup(event):
+        return warm_up(client)
+
+    # The asynchronous invocation from start_render:
+    if event.get('render'):
+        key, _, _ = cached_image(event['render']['prompt'], **event['render']['config'])
+        finish_render(key)
+        return {'statusCode': 200}
+
     # extract a query parameter called "prompt" from the input event:
     prompt = "picture of two happy golden retrievers playing tug-o-war"
-    query_parameters = event.get('queryStringParameters')
-    if query_parameters:
-        prompt = query_parameters.get('prompt',prompt)
+    query_parameters = event.get('queryStringParameters') or {}
+    prompt = query_parameters.get('prompt',prompt)
+    if 'seeds' in query_parameters or 'sizes' in query_parameters:
+        return variants_handler(prompt, query_parameters)
+    if 'job' in query_parameters:
+        return poll_handler(query_parameters['job'], event)
+    if query_parameters.get('progressive') == '1':
+        return progressive_handler(prompt)
+
+    size = query_parameters.get('size', 'full')
+    if size not in tiers:
+        return {'statusCode': 400, 'body': json.dumps({"error": f"size is one of {', '.join(tiers)}"})}
+    accept = next((value for name, value in (event.get('headers') or {}).items() if name.lower() == 'accept'), None)
+    tier, image_format = rendition(size, choose_format(accept))
+
+    # The image's cache key is known before it is generated, so a client that already has it
+    # (If-None-Match with its ETag) gets a 304 without the image being generated or even read:
+    key = image_key(ModelId, prompt, **default_config)
+    name = rendition_key(key, tier, image_format)
+    headers = {
+        'Content-Type': content_types[image_format],
+        'ETag': etag_for(name),
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Vary': 'Accept',
+    }
+    if not_modified(event.get('headers'), headers['ETag']):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
 
-    response = call_bedrock(prompt);
+    timer = PhaseTimer()
+    with timer.phase('total'):
+        image = None
+        if name != key:
+            with timer.phase('cache_get'):
+                image = cache.get(name)
+        hit = image is not None
+        if image is None:
+            key, png, hit = cached_image(prompt, timer, **default_config)
+            image = png
+            if name != key:
+                with timer.phase('transcode'):
+                    image = transcode(png, tier, image_format)
+                cache.put(name, image, content_types[image_format])
+                if not hit and (cache.disk or cache.s3):
+                    background.submit(prerender, key, png, (tier, image_format))
+    headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    headers['Content-Length'] = str(len(image))
+    emit_metrics(timer)
 
     return {
         'statusCode': 200,
-        'headers': {
-            'Content-Type': 'image/png',  
-        },
-        'body': response,
+        'headers': headers,
+        'body': base64.b64encode(image).decode('ascii'),
         'isBase64Encoded': True,
     }    
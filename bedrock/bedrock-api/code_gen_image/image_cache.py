@@ -0,0 +1,147 @@
+import hashlib, json, os, tempfile, threading
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from bedrock_startup import get_client
+
+# Content-addressed image cache.  Titan Image Generator is deterministic for a given model, prompt
+# and imageGenerationConfig (the seed is part of it), so the hash of those is a name for the image
+# itself: it is the cache key, the S3 object name and the HTTP ETag.  Two tiers:
+#   - an LRU of files in /tmp, which survives between invocations of a warm container
+#   - an optional S3 bucket, shared by every container (moto can stand in for it in tests)
+
+
+def image_key(model_id, prompt, seed, cfg_scale, width, height, quality):
+    text = json.dumps([model_id, " ".join(prompt.split()), seed, cfg_scale, width, height, quality],
+                      separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Files in a directory, evicted least recently used first once they add up to more than max_bytes.
+# Files left by an earlier container (or run) are picked up, oldest first.
+class DiskTier:
+
+    def __init__(self, directory="/tmp/image-cache", max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if not name.endswith(".tmp")]
+        for path in sorted(paths, key=os.path.getmtime):
+            self.entries[os.path.basename(path)] = os.path.getsize(path)
+            self.total_bytes += self.entries[os.path.basename(path)]
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(os.path.join(self.directory, key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        # Written to a temporary file of its own and renamed, so a reader never sees half an image
+        # and two threads writing the same key don't trip over each other:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self.lock:
+            self.total_bytes += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except FileNotFoundError:
+                    pass
+
+
+class S3Tier:
+
+    def __init__(self, bucket, prefix="images/", s3=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3 = s3 or get_client('s3')
+
+    def get(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def put(self, key, data, content_type="image/png"):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=content_type,
+                           CacheControl="public, max-age=31536000, immutable")
+
+    def url(self, key, expires_in=3600):
+        # A presigned link, so clients can fetch the image straight from S3:
+        return self.s3.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self.prefix + key},
+                                              ExpiresIn=expires_in)
+
+
+class ImageCache:
+
+    def __init__(self, disk=None, s3=None):
+        self.disk = disk
+        self.s3 = s3
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+        self.s3_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        data = self.disk.get(key) if self.disk else None
+        if data is not None:
+            self._count("disk_hits")
+            return data
+        data = self.s3.get(key) if self.s3 else None
+        if data is not None:
+            # Keep a local copy, so the next request doesn't go to S3 again:
+            self._count("s3_hits")
+            if self.disk:
+                self.disk.put(key, data)
+            return data
+        self._count("misses")
+        return None
+
+    def put(self, key, data, content_type="image/png"):
+        if self.disk:
+            self.disk.put(key, data)
+        if self.s3:
+            self.s3.put(key, data, content_type)
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self.lock:
+            return {"disk_hits": self.disk_hits, "s3_hits": self.s3_hits, "misses": self.misses}
+
+
+# HTTP validators: the key doubles as a strong ETag, since the same key always means the same bytes.
+def etag_for(key):
+    return f'"{key}"'
+
+
+def not_modified(headers, etag):
+    # If-None-Match can list several tags, or "*"; W/ (weak) tags still match for If-None-Match:
+    for name, value in (headers or {}).items():
+        if name.lower() == 'if-none-match':
+            tags = [tag.strip() for tag in value.split(',')]
+            return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+    return False
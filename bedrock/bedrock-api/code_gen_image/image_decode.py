@@ -0,0 +1,63 @@
+import binascii
+from contextlib import nullcontext
+
+# Low-memory decode of a Titan image response.  json.loads on the whole body needs the raw body,
+# the parsed base64 string and then the decoded PNG all at once: nearly four times the image
+# size at the peak.  This reads the body a chunk at a time, finds the first string in "images"
+# and decodes its base64 as it goes, so only the PNG bytes themselves pile up.
+#
+# It relies on the shape of Titan's response ({"images": ["<base64>", ...], "error": null});
+# base64 has no characters JSON needs to escape, apart from the optional "\/" for "/".
+
+
+class ImageDecodeError(ValueError):
+    pass
+
+
+def iter_image_bytes(body, chunk_size=64 * 1024, timer=None):
+    # body is anything with read(n), like botocore's StreamingBody; yields pieces of the PNG.
+    # With a PhaseTimer, reading counts as the 'read' phase and decoding as 'parse'.
+    phase = timer.phase if timer else lambda name: nullcontext()
+
+    def read():
+        with phase('read'):
+            return body.read(chunk_size)
+
+    # Find the opening quote of the first image, keeping a little overlap between chunks:
+    buffer = b""
+    while True:
+        chunk = read()
+        if not chunk:
+            raise ImageDecodeError("no images in the response")
+        buffer += chunk
+        start = buffer.find(b'"images"')
+        if start >= 0:
+            quote = buffer.find(b'"', start + len(b'"images"'))
+            if quote >= 0:
+                if b"".join(buffer[start + len(b'"images"'):quote].split()) != b":[":
+                    raise ImageDecodeError("images is not a list of strings")
+                buffer = buffer[quote + 1:]
+                break
+            buffer = buffer[start:]
+        else:
+            buffer = buffer[-len(b'"images"'):]
+
+    # Decode whole 4-character groups of base64, carrying the rest over to the next chunk:
+    pending = b""
+    while True:
+        end = buffer.find(b'"')
+        text = pending + (buffer if end < 0 else buffer[:end]).replace(b"\\", b"")
+        usable = len(text) - len(text) % 4 if end < 0 else len(text)
+        with phase('parse'):
+            data = binascii.a2b_base64(text[:usable])
+        if data:
+            yield data
+        if end >= 0:
+            # Read the (short) rest of the body, so the connection can be reused:
+            while read():
+                pass
+            return
+        pending = text[usable:]
+        buffer = read()
+        if not buffer:
+            raise ImageDecodeError("the response ended in the middle of the image")
@@ -0,0 +1,70 @@
+import io, os
+
+# Optional: without Pillow (pip install Pillow) images are only served as the original PNG.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Smaller renditions of a generated PNG.  WebP and JPEG are a fraction of the PNG's size,
+# which matters because API Gateway carries images base64 encoded (a third bigger again)
+# and caps responses at 10 MB.  Tiers are the longest side in pixels (None = as generated).
+tiers = {"thumbnail": 128, "medium": 512, "full": None}
+content_types = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+quality = {
+    "webp": int(os.environ.get('IMAGE_WEBP_QUALITY', '80')),
+    "jpeg": int(os.environ.get('IMAGE_JPEG_QUALITY', '85')),
+}
+
+
+def available():
+    return Image is not None
+
+
+def quality_value(params):
+    # The q of an Accept entry's parameters ("q=0.8", " Q = 0.8", "level=1"), or None if it isn't a number
+    for param in params:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'q':
+            try:
+                return float(value.strip())
+            except ValueError:
+                return None
+    return 1.0
+
+
+def choose_format(accept):
+    # Only formats the client lists by name (with q > 0), best compression first; otherwise PNG as before.
+    # Entries that can't be parsed are skipped rather than failing the request.
+    accepted = set()
+    for item in (accept or '').split(','):
+        media_type, *params = item.split(';')
+        q = quality_value(params)
+        if q is not None and q > 0:
+            accepted.add(media_type.strip().lower())
+    if available():
+        for image_format in ("webp", "jpeg"):
+            if content_types[image_format] in accepted:
+                return image_format
+    return "png"
+
+
+def rendition(tier, image_format):
+    # What will actually be served: without Pillow, that's always the original
+    return (tier, image_format) if available() else ("full", "png")
+
+
+def transcode(png, tier, image_format):
+    if tier == "full" and image_format == "png":
+        return png
+    image = Image.open(io.BytesIO(png))
+    if tiers[tier]:
+        image.thumbnail((tiers[tier], tiers[tier]))
+    out = io.BytesIO()
+    if image_format == "jpeg":
+        image.convert("RGB").save(out, "JPEG", quality=quality["jpeg"], optimize=True)
+    elif image_format == "webp":
+        image.save(out, "WEBP", quality=quality["webp"], method=4)
+    else:
+        image.save(out, "PNG", optimize=True)
+    return out.getvalue()
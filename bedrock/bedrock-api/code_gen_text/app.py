@@ -1,52 +1,249 @@
-import boto3, json
+import base64, gzip, json, os, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-client = boto3.client('bedrock-runtime')
+from bedrock_cache import ResponseCache, cache_key
+from bedrock_limiter import AdaptiveLimiter, call_with_retry
+from bedrock_metering import Meter, EmfSink, BudgetExceeded, caller_from_event
+from bedrock_metrics import PhaseTimer, init_timer, emit_metrics
+from bedrock_startup import get_client, is_warmup, warm_up
+
+# botocore's own retries are turned off; call_with_retry backs off with jitter instead
+with init_timer.phase('client'):
+    client = get_client('bedrock-runtime', retries={'total_max_attempts': 1})
 modelId="amazon.titan-text-lite-v1"
+default_prompt = "What are the top 3 recommended European vacation destinations for extroverts?"
+
+# Calls are paced to BEDROCK_REQUESTS_PER_SECOND (0 = no rate cap, just adaptive concurrency):
+limiter = AdaptiveLimiter(
+    rate=float(os.environ.get('BEDROCK_REQUESTS_PER_SECOND', '0')),
+    max_limit=int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '64')))
+
+# temperature is 0, so a repeated prompt gets the same answer: each container remembers
+# BEDROCK_CACHE_SIZE answers (0 turns it off) for BEDROCK_CACHE_TTL seconds.
+cache = ResponseCache(
+    max_entries=int(os.environ.get('BEDROCK_CACHE_SIZE', '1024')),
+    ttl_seconds=float(os.environ.get('BEDROCK_CACHE_TTL', '3600')))
+
+# A POST of a JSON array of prompts is answered BEDROCK_BATCH_CONCURRENCY prompts at a time:
+batch_concurrency = int(os.environ.get('BEDROCK_BATCH_CONCURRENCY', '4'))
+max_batch_size = int(os.environ.get('BEDROCK_MAX_BATCH_SIZE', '50'))
+
+# Token usage per tenant and route goes to CloudWatch as EMF lines every BEDROCK_METER_FLUSH_SECONDS
+# (flushed by the next call after that, since a frozen container can't flush on a timer).
+# Per-tenant budgets per BEDROCK_BUDGET_WINDOW seconds, e.g. BEDROCK_TOKEN_BUDGETS='{"acme": 200000, "*": 50000}'
+meter = Meter(
+    EmfSink(),
+    flush_seconds=float(os.environ.get('BEDROCK_METER_FLUSH_SECONDS', '60')),
+    budgets=json.loads(os.environ.get('BEDROCK_TOKEN_BUDGETS', '{}')),
+    budget_window=float(os.environ.get('BEDROCK_BUDGET_WINDOW', '86400')))
 
-def call_bedrock(prompt):
+
+def build_body(prompt):
 
     # if the prompt is empty, set it to a default value
     if not prompt:
-        prompt = "What are the top 3 recommended European vacation destinations for extroverts?"
+        prompt = default_prompt
 
     # Note that the input for the body depends on the selected model
     # This body works for Amazon Titan:
-    body = {
+    return {
         "inputText": f"{prompt}",
         "textGenerationConfig":
         {"temperature": 0, "topP": 0.9, "maxTokenCount": 512, "stopSequences": [] }
         }
 
-    # There is also a streaming option
-    response = client.invoke_model(
-        contentType="application/json",
-        accept="*/*",
-        modelId=modelId,
-        body=json.dumps(body)  
-    )
 
-    return json.loads(response.get('body').read()).get('results')[0].get('outputText')
+def stream_bedrock(prompt, timer=None):
+    timer = timer or PhaseTimer()
+
+    with timer.phase('serialize'):
+        body = json.dumps(build_body(prompt))
+
+    # The streaming option hands back the answer a few tokens at a time,
+    # so the caller sees the first words long before the model is finished.
+    # 'invoke' is the time to the first byte, 'stream' the rest of the generation.
+    with timer.phase('invoke'):
+        response = client.invoke_model_with_response_stream(
+            contentType="application/json",
+            accept="*/*",
+            modelId=modelId,
+            body=body
+        )
+
+    # Each event carries a JSON chunk; for Titan the new text is in "outputText",
+    # and the last chunk also has the token counts.
+    # Errors from the model show up while iterating, as botocore EventStreamErrors.
+    with timer.phase('stream'):
+        for event in response.get('body'):
+            chunk = event.get('chunk')
+            if chunk:
+                with timer.phase('parse'):
+                    data = json.loads(chunk.get('bytes'))
+                timer.count('input_tokens', data.get('inputTextTokenCount'))
+                timer.count('output_tokens', data.get('totalOutputTextTokenCount'))
+                text = data.get('outputText')
+                if text:
+                    yield text
+
+
+def call_bedrock(prompt, timer=None, caller=None, route=None):
+
+    # Same contract as before (prompt in, whole answer out), just built on the stream.
+    # The token counts the stream reports into the timer are metered for the caller.
+    timer = timer or PhaseTimer()
+    key = cache_key(modelId, build_body(prompt))
+    with timer.phase('cache_get'):
+        response = cache.get(key)
+    timer.count('cache_hit', int(response is not None))
+    if response is not None:
+        return response
+
+    # Cached answers are free; a caller that has used up its token budget can't make new calls:
+    meter.check_budget(caller)
+    start = time.perf_counter()
+    response = call_with_retry(lambda: "".join(stream_bedrock(prompt, timer)), limiter)
+    latency = time.perf_counter() - start
+    meter.record(caller, route, modelId, timer.counts.get('input_tokens'), timer.counts.get('output_tokens'), latency)
+    cache.put(key, response, latency)
+    return response
+
+
+def stream_metered(prompt, caller=None, route=None):
+
+    # stream_bedrock for a caller: the budget is checked before the call, and whatever the
+    # stream used is recorded when it ends, even if the client went away halfway through.
+    meter.check_budget(caller)
+    timer = PhaseTimer()
+    start = time.perf_counter()
+
+    # Throttling shows up before the first chunk, so the call is paced and retried up to there;
+    # after that the client already has part of the answer and a retry would repeat it.
+    def first_chunk():
+        chunks = stream_bedrock(prompt, timer)
+        return chunks, next(chunks, "")
+
+    chunks, first = call_with_retry(first_chunk, limiter)
+    try:
+        yield first
+        yield from chunks
+    finally:
+        meter.record(caller, route, modelId, timer.counts.get('input_tokens'), timer.counts.get('output_tokens'),
+                     time.perf_counter() - start)
+
+
+def parse_prompts(event):
+    # The API has BinaryMediaTypes */*, so API Gateway hands us the request body base64 encoded
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    prompts = json.loads(body)
+    if not isinstance(prompts, list) or not all(isinstance(p, str) for p in prompts):
+        raise ValueError("expected a JSON array of prompt strings")
+    if not 0 < len(prompts) <= max_batch_size:
+        raise ValueError(f"expected 1 to {max_batch_size} prompts")
+    return prompts
+
+
+def call_bedrock_batch(prompts, caller=None, route=None):
+
+    # One newline-delimited JSON line per prompt, in the order the answers finish;
+    # "index" says which prompt it belongs to.  A failed prompt gets an "error" line
+    # instead of failing the whole batch.
+    with ThreadPoolExecutor(max_workers=min(batch_concurrency, len(prompts))) as pool:
+        futures = {pool.submit(call_bedrock, prompt, caller=caller, route=route): index for index, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                line = {"index": index, "prompt": prompts[index], "response": future.result()}
+            except Exception as e:
+                line = {"index": index, "prompt": prompts[index], "error": str(e)}
+            yield json.dumps(line) + "\n"
+
+
+def accepts_gzip(headers):
+    # Header names can come in any case; "gzip;q=0" means "anything but gzip".
+    # A coding with a q that isn't a number ("gzip;q=x") is skipped rather than failing the request.
+    for name, value in (headers or {}).items():
+        if name.lower() == 'accept-encoding':
+            for coding in value.split(','):
+                coding, *params = coding.split(';')
+                if coding.strip().lower() != 'gzip':
+                    continue
+                quality = 1.0
+                for param in params:
+                    param, _, number = param.partition('=')
+                    if param.strip().lower() == 'q':
+                        try:
+                            quality = float(number.strip())
+                        except ValueError:
+                            quality = 0.0
+                if quality > 0:
+                    return True
+    return False
 
 
 
 if __name__ == "__main__":
-    result = call_bedrock("When is the next planetary conjunction involving at least three planets?")
-    print(result)
+    for text in stream_bedrock("When is the next planetary conjunction involving at least three planets?"):
+        print(text, end="", flush=True)
+    print()
 
 
 
 # Lambda Handler:
 def lambda_handler(event, context):
 
+    if is_warmup(event):
+        return warm_up(client)
+
+    if event.get('httpMethod') == 'POST':
+        return batch_handler(event)
+
     # extract a query parameter called "prompt" from the input event:
     prompt = event['queryStringParameters']['prompt']
     
-    response = call_bedrock(prompt)
+    timer = PhaseTimer()
+    try:
+        with timer.phase('total'):
+            response = call_bedrock(prompt, timer, caller_from_event(event), event.get('resource'))
+    except BudgetExceeded as e:
+        return {"statusCode": 429, "body": json.dumps({"error": str(e)})}
+    emit_metrics(timer)
 
     return {
         "statusCode": 200,
+        "headers": {"X-Cache": "HIT" if timer.counts['cache_hit'] else "MISS"},
         "body": json.dumps({
             "prompt": prompt,
             "response": response,
+            "cache": cache.stats(),
+            "limiter": limiter.metrics(),
         }),
     }
+
+
+# POST /text with a JSON array of prompts.  API Gateway (REST) buffers the whole response,
+# so here the lines arrive in completion order but all at once; the GenerateTextStream
+# Function URL (stream_server.py) sends each line as soon as it is ready.
+def batch_handler(event):
+    try:
+        prompts = parse_prompts(event)
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+    timer = PhaseTimer()
+    with timer.phase('total'):
+        body = "".join(call_bedrock_batch(prompts, caller_from_event(event), event.get('resource')))
+    timer.count('prompts', len(prompts))
+    emit_metrics(timer)
+
+    headers = {"Content-Type": "application/x-ndjson", "Vary": "Accept-Encoding"}
+    if not accepts_gzip(event.get('headers')):
+        return {"statusCode": 200, "headers": headers, "body": body}
+    headers["Content-Encoding"] = "gzip"
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": base64.b64encode(gzip.compress(body.encode('utf-8'))).decode('ascii'),
+        "isBase64Encoded": True,
+    }
@@ -0,0 +1,101 @@
+import base64, json, os, time, uuid
+
+from bedrock_metering import caller_from_event
+from bedrock_startup import get_client
+
+# Submit/poll API for long generations, so API Gateway doesn't hold a connection open
+# (and time out) while the model works:
+#   POST /text/jobs       {"prompt": ...}  ->  202 {"job_id": ..., "status_url": ...}
+#   GET  /text/jobs/{id}                   ->  200 {"status": "PENDING" | "RUNNING" | "COMPLETE" | "FAILED", ...}
+# The submit function starts the worker function asynchronously, and the worker writes the
+# answer to the jobs table.  Set JOBS_TABLE_ENDPOINT=http://localhost:8000 to use DynamoDB Local,
+# and call worker_handler directly to run a job without Lambda.
+
+table_name = os.environ.get('JOBS_TABLE', 'text-jobs')
+job_ttl_seconds = 24 * 60 * 60
+
+dynamodb = get_client('dynamodb', endpoint_url=os.environ.get('JOBS_TABLE_ENDPOINT'))
+
+
+def save_job(job):
+    item = {name: {"S": str(value)} for name, value in job.items() if value is not None}
+    item["expires_at"] = {"N": str(int(job["created_at"]) + job_ttl_seconds)}
+    dynamodb.put_item(TableName=table_name, Item=item)
+
+
+def load_job(job_id):
+    item = dynamodb.get_item(TableName=table_name, Key={"job_id": {"S": job_id}}, ConsistentRead=True).get("Item")
+    if item:
+        return {name: value.get("S", value.get("N")) for name, value in item.items() if name != "expires_at"}
+
+
+def respond(status_code, body, headers=None):
+    return {"statusCode": status_code, "headers": headers or {}, "body": json.dumps(body)}
+
+
+def dispatch(payload):
+    # Fire-and-forget ("Event") invoke of the worker function:
+    get_client('lambda').invoke(
+        FunctionName=os.environ['JOBS_WORKER_FUNCTION'],
+        InvocationType='Event',
+        Payload=json.dumps(payload))
+
+
+def generate(prompt, caller=None):
+    # Imported here so the submit and status functions don't build a Bedrock client they never use:
+    from app import call_bedrock
+    return call_bedrock(prompt, caller=caller, route="/text/jobs")
+
+
+def parse_body(event):
+    # The API has BinaryMediaTypes */*, so API Gateway hands us the request body base64 encoded
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body, validate=True).decode('utf-8')
+    body = json.loads(body or '{}')
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object like {\"prompt\": ...}")
+    return body
+
+
+def submit_handler(event, context):
+    try:
+        body = parse_body(event)
+    except ValueError as e:
+        return respond(400, {"message": str(e)})
+    prompt = body.get('prompt') or (event.get('queryStringParameters') or {}).get('prompt')
+
+    now = int(time.time())
+    # The worker meters the job's tokens against the tenant that submitted it:
+    job = {"job_id": uuid.uuid4().hex, "status": "PENDING", "prompt": prompt or "",
+           "caller": caller_from_event(event), "created_at": now, "updated_at": now}
+    save_job(job)
+    dispatch({"job_id": job["job_id"], "prompt": job["prompt"], "caller": job["caller"]})
+
+    status_url = f"/text/jobs/{job['job_id']}"
+    return respond(202, {"job_id": job["job_id"], "status": "PENDING", "status_url": status_url},
+                   {"Location": status_url})
+
+
+def worker_handler(event, context):
+    job = load_job(event['job_id']) or {"job_id": event['job_id'], "prompt": event.get('prompt', ''),
+                                        "caller": event.get('caller'), "created_at": int(time.time())}
+    job.update(status="RUNNING", updated_at=int(time.time()))
+    save_job(job)
+
+    try:
+        job.update(status="COMPLETE", response=generate(job["prompt"], job.get("caller")))
+    except Exception as e:
+        job.update(status="FAILED", error=f"{type(e).__name__}: {e}")
+    job["updated_at"] = int(time.time())
+    save_job(job)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+def status_handler(event, context):
+    job = load_job((event.get('pathParameters') or {}).get('id', ''))
+    if not job:
+        return respond(404, {"message": "job not found"})
+    for name in ("created_at", "updated_at"):
+        job[name] = int(job[name])
+    return respond(200, job)
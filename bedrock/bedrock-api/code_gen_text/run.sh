@@ -0,0 +1,2 @@
+#!/bin/bash
+exec python3 stream_server.py
@@ -0,0 +1,92 @@
+# Response-streaming entry point for the /text function.
+# The Python Lambda runtime can't stream a response on its own, so this function runs
+# behind the AWS Lambda Web Adapter (see GenerateTextStream in template.yaml).  The adapter
+# passes the Function URL request to this little HTTP server and relays each chunk we
+# write straight back to the client, so the first tokens arrive while the model is still going.
+import os, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from app import stream_metered, parse_prompts, call_bedrock_batch, accepts_gzip
+from bedrock_metering import BudgetExceeded, caller_from_event
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        # The adapter polls this path until the server is up; don't call the model for it:
+        if url.path == "/healthz":
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        prompt = parse_qs(url.query).get("prompt", [""])[0]
+        chunks = stream_metered(prompt, self.caller(), url.path)
+
+        # Wait for the first chunk before sending headers, so a failed call can still be a 500:
+        try:
+            first = next(chunks, "")
+        except BudgetExceeded as e:
+            self.send_error(429, str(e))
+            return
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self.write_chunk(first)
+        for text in chunks:
+            self.write_chunk(text)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        # A JSON array of prompts; each answer goes out as an NDJSON line as soon as it's done.
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            prompts = parse_prompts({"body": body.decode("utf-8")})
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        gzipped = accepts_gzip(dict(self.headers))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Vary", "Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        # A sync flush after every line lets the client decompress each line as it arrives:
+        compressor = zlib.compressobj(wbits=31) if gzipped else None
+        for line in call_bedrock_batch(prompts, self.caller(), urlparse(self.path).path):
+            data = line.encode("utf-8")
+            if compressor:
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.write_chunk(data)
+        if compressor:
+            self.write_chunk(compressor.flush())
+        self.wfile.write(b"0\r\n\r\n")
+
+    def caller(self):
+        # The same tenant header the API Gateway handlers meter by:
+        return caller_from_event({"headers": dict(self.headers)})
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8") if isinstance(text, str) else text
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", "8080"))
+    ThreadingHTTPServer(("127.0.0.1", port), StreamHandler).serve_forever()
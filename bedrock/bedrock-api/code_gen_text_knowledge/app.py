@@ -1,9 +1,15 @@
-import boto3, json
+import json
 
-client = boto3.client('bedrock-agent-runtime')
+from bedrock_metrics import PhaseTimer, init_timer, emit_metrics
+from bedrock_startup import get_client, is_warmup, warm_up
+
+with init_timer.phase('client'):
+    client = get_client('bedrock-agent-runtime')
 modelId="amazon.titan-text-lite-v1"
 
-def call_bedrock(prompt):
+def call_bedrock(prompt, timer=None):
+    timer = timer or PhaseTimer()
+
     # if the prompt is empty, set it to a default value
     if not prompt:
         prompt = "What are the top 3 most popular course titles based on 'Students (OPS)'? Show the sum of 'Students (OPS)' for each."
@@ -11,18 +17,19 @@ def call_bedrock(prompt):
     # Call the knowledge base:
     # TODO: REMOVE HARD-CODING OF KNOWLEDGEBASEID
     # TODO: PRESENTLY NOT RESPONDING WITH INFORMATION FROM KNOWLEDGEBASE
-    response = client.retrieve_and_generate(
-        input={
-            'text': prompt
-        },
-        retrieveAndGenerateConfiguration={
-            'type': 'KNOWLEDGE_BASE',
-            'knowledgeBaseConfiguration': {
-                'knowledgeBaseId': 'YSP1FFNJUU',
-                'modelArn': 'arn:aws:bedrock:us-west-2::foundation-model/anthropic.claude-instant-v1'
+    with timer.phase('invoke'):
+        response = client.retrieve_and_generate(
+            input={
+                'text': prompt
+            },
+            retrieveAndGenerateConfiguration={
+                'type': 'KNOWLEDGE_BASE',
+                'knowledgeBaseConfiguration': {
+                    'knowledgeBaseId': 'YSP1FFNJUU',
+                    'modelArn': 'arn:aws:bedrock:us-west-2::foundation-model/anthropic.claude-instant-v1'
+                }
             }
-        }
-    )
+        )
 
     return response['output']['text']
 
@@ -37,10 +44,16 @@ if __name__ == "__main__":
 # Lambda Handler:
 def lambda_handler(event, context):
 
+    if is_warmup(event):
+        return warm_up(client)
+
     # extract a query parameter called "prompt" from the input event:
     prompt = event['queryStringParameters']['prompt']
     
-    response = call_bedrock(prompt)
+    timer = PhaseTimer()
+    with timer.phase('total'):
+        response = call_bedrock(prompt, timer)
+    emit_metrics(timer)
 
     return {
         "statusCode": 200,
@@ -0,0 +1,186 @@
+import asyncio, hashlib, json, sqlite3, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import boto3
+
+
+# call_bedrock runs with temperature 0, so the same request body always produces the same answer.
+# That makes it safe to remember answers: the key is a hash of the model and the request body
+# (prompt plus generation config), with the prompt's whitespace normalized first.
+def cache_key(model_id, body):
+    body = dict(body)
+    body["inputText"] = " ".join(str(body.get("inputText", "")).split())
+    text = json.dumps([model_id, body], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Two-tier cache: an in-process LRU (size and TTL limited) in front of an optional persistent store.
+# The store only needs get(key) -> (text, latency) or None, and put(key, text, latency, expires_at).
+class ResponseCache:
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, store=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self.clock = clock
+        self.entries = OrderedDict()    # key -> (expires_at, text, latency)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0        # model time we didn't have to spend thanks to hits
+
+    def get(self, key):
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[2]
+                return entry[1]
+            if entry:
+                del self.entries[key]
+
+        # Not in memory, so try the persistent tier and promote what we find:
+        found = self.store.get(key) if self.store else None
+        with self.lock:
+            if found is None:
+                self.misses += 1
+                return None
+            text, latency = found
+            self.store_hits += 1
+            self.saved_seconds += latency
+            self._remember(key, text, latency, now + self.ttl_seconds)
+        return text
+
+    def put(self, key, text, latency=0.0):
+        expires_at = self.clock() + self.ttl_seconds
+        with self.lock:
+            self._remember(key, text, latency, expires_at)
+        if self.store:
+            self.store.put(key, text, latency, expires_at)
+
+    def _remember(self, key, text, latency, expires_at):
+        self.entries[key] = (expires_at, text, latency)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.store_hits) / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "entries": len(self.entries),
+            }
+
+
+# Single-flight: when several callers ask for the same key at the same time, only the first
+# one (the leader) runs fn(); the others wait for it and get the same answer, or the same error.
+# Once the call is done it is forgotten, so errors are never remembered for later callers.
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}     # key -> Future for the call in flight
+        self.shared = 0     # how many callers got a result without making their own call
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+# The same for asyncio tasks: the first caller's coroutine runs as a task the others await.
+# shield() keeps one impatient (cancelled) caller from cancelling the call for everyone else.
+class AsyncSingleFlight:
+
+    def __init__(self):
+        self.calls = {}
+        self.shared = 0
+
+    async def do(self, key, fn):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.calls.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+# Persistent tier in a local SQLite file.  /tmp survives between warm Lambda invocations,
+# and on a laptop it survives between runs of the script.
+class SqliteStore:
+
+    def __init__(self, path="/tmp/bedrock-cache.db", clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, text TEXT, latency REAL, expires_at REAL)")
+        self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT text, latency FROM responses WHERE key = ? AND expires_at > ?",
+                (key, self.clock())).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key, text, latency, expires_at):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, text, latency, expires_at))
+            self.db.commit()
+
+
+# Persistent tier in a DynamoDB table with a string partition key called "key".
+# Turn on DynamoDB TTL for the "expires_at" attribute to have old items cleaned up;
+# pass endpoint_url="http://localhost:8000" to run against DynamoDB Local.
+class DynamoDbStore:
+
+    def __init__(self, table_name, endpoint_url=None, clock=time.time):
+        self.table_name = table_name
+        self.clock = clock
+        self.client = boto3.client("dynamodb", endpoint_url=endpoint_url)
+
+    def get(self, key):
+        item = self.client.get_item(TableName=self.table_name, Key={"key": {"S": key}}).get("Item")
+        if not item or float(item["expires_at"]["N"]) <= self.clock():
+            return None
+        return item["text"]["S"], float(item["latency"]["N"])
+
+    def put(self, key, text, latency, expires_at):
+        self.client.put_item(TableName=self.table_name, Item={
+            "key": {"S": key},
+            "text": {"S": text},
+            "latency": {"N": str(latency)},
+            "expires_at": {"N": str(int(expires_at))},
+        })
@@ -0,0 +1,92 @@
+import random, threading, time
+from collections import deque
+
+from botocore.exceptions import ClientError
+
+
+# Keeps Bedrock calls at a pace the account quota can take, instead of bursting into
+# ThrottlingExceptions and retrying in lockstep:
+#  - a token bucket caps the request rate (rate=0 turns it off)
+#  - the number of calls in flight follows AIMD: it grows a little after every success,
+#    and is cut in half (multiplicative decrease) whenever a call is throttled.
+class AdaptiveLimiter:
+
+    def __init__(self, rate=0.0, burst=None, initial_limit=4, min_limit=1, max_limit=64,
+                 decrease=0.5, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.clock = clock
+        self.refilled_at = clock()
+        self.in_flight = 0
+        self.outcomes = deque(maxlen=100)   # recent calls, True for the ones that were throttled
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                self._refill()
+                if self.in_flight < int(self.limit) and (not self.rate or self.tokens >= 1):
+                    break
+                # Either wait for a slot to be released, or for the next token to drip in:
+                if self.in_flight >= int(self.limit) or not self.rate:
+                    self.cond.wait()
+                else:
+                    self.cond.wait((1 - self.tokens) / self.rate)
+            self.in_flight += 1
+            if self.rate:
+                self.tokens -= 1
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            self.outcomes.append(throttled)
+            if throttled:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+            else:
+                # +1 per "window" of limit successes, the classic additive increase:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def metrics(self):
+        with self.cond:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "throttle_rate": round(sum(self.outcomes) / len(self.outcomes), 4) if self.outcomes else 0.0,
+            }
+
+
+def is_throttle(error):
+    # Covers both invoke_model errors and the lowercase ones inside response streams:
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code', '')
+        return code.lower() in ('throttlingexception', 'toomanyrequestsexception')
+    return False
+
+
+# Runs fn() under the limiter, retrying throttled calls after a "full jitter" backoff
+# (a random wait up to an exponentially growing cap), so retries don't all land together.
+# Anything other than throttling is raised straight away.
+def call_with_retry(fn, limiter, max_attempts=5, base_delay=0.25, max_delay=8.0, sleep=time.sleep):
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        throttled = False
+        try:
+            return fn()
+        except Exception as e:
+            throttled = is_throttle(e)
+            if not throttled or attempt == max_attempts - 1:
+                raise
+        finally:
+            limiter.release(throttled)
+        sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
@@ -0,0 +1,207 @@
+import json, sys, threading, time
+
+
+# Token metering: every model call is recorded with its caller (tenant), route, model, token counts
+# (input, output, and for models with prompt caching, tokens read from and written to the cache)
+# and latency.  Counters are kept per thread, so recording a call only takes a lock on a thread's
+# first call, to register its counters; once the thread exits they're folded into a shared total.
+# Counters only ever grow, and a flush sends the difference since the last flush to a sink
+# (a JSONL file or CloudWatch EMF log lines), one row per (caller, route, model).
+#
+# Budgets cap how many tokens (of every kind) a caller can use per budget window, e.g.
+# budgets={"acme": 200_000, "*": 50_000}.  They are counted per process (per Lambda container);
+# add up the flushed rows for an account-wide view.
+
+
+# Who's calling, for an API Gateway event: the X-Tenant-Id header, or else the API key.
+def caller_from_event(event):
+    headers = {name.lower(): value for name, value in (event.get("headers") or {}).items()}
+    identity = (event.get("requestContext") or {}).get("identity") or {}
+    return headers.get("x-tenant-id") or identity.get("apiKey") or None
+
+
+class BudgetExceeded(Exception):
+
+    def __init__(self, caller, used, budget):
+        super().__init__(f"{caller} has used {used} of its {budget} token budget")
+        self.caller = caller
+        self.used = used
+        self.budget = budget
+
+
+# Appends one JSON line per row:
+class FileSink:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, rows, timestamp):
+        with self.lock, open(self.path, "a") as f:
+            for row in rows:
+                f.write(json.dumps(dict(row, timestamp=timestamp)) + "\n")
+
+
+# Prints one Embedded Metric Format line per row; CloudWatch turns them into metrics
+# with Caller, Route and Model dimensions:
+class EmfSink:
+
+    def __init__(self, namespace="BedrockUsage", out=None):
+        self.namespace = namespace
+        self.out = out
+
+    def write(self, rows, timestamp):
+        for row in rows:
+            record = {
+                "_aws": {
+                    "Timestamp": int(timestamp * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Caller", "Route", "Model"]],
+                        "Metrics": [{"Name": "Calls", "Unit": "Count"},
+                                    {"Name": "InputTokens", "Unit": "Count"},
+                                    {"Name": "OutputTokens", "Unit": "Count"},
+                                    {"Name": "CacheReadTokens", "Unit": "Count"},
+                                    {"Name": "CacheWriteTokens", "Unit": "Count"},
+                                    {"Name": "ModelLatency", "Unit": "Milliseconds"}],
+                    }],
+                },
+                "Caller": row["caller"],
+                "Route": row["route"],
+                "Model": row["model"],
+                "Calls": row["calls"],
+                "InputTokens": row["input_tokens"],
+                "OutputTokens": row["output_tokens"],
+                "CacheReadTokens": row["cache_read_tokens"],
+                "CacheWriteTokens": row["cache_write_tokens"],
+                "ModelLatency": round(row["seconds"] * 1000, 3),
+            }
+            print(json.dumps(record), file=self.out or sys.stdout, flush=True)
+
+
+class Meter:
+
+    def __init__(self, sink=None, flush_seconds=60.0, budgets=None, budget_window=86400.0, clock=time.time):
+        self.sink = sink
+        self.flush_seconds = flush_seconds
+        self.budgets = budgets or {}
+        self.budget_window = budget_window
+        self.clock = clock
+        self.local = threading.local()
+        # Each live thread's (thread, {(caller, route, model): [calls, input, output, seconds, cache_read, cache_write]}):
+        self.shards = []
+        self.retired = {}           # what threads that have since exited recorded
+        self.lock = threading.Lock()        # only taken to add or retire a thread's shard, or to roll the budget window
+        self.flush_lock = threading.Lock()
+        self.flushed = {}           # key -> totals as of the last flush
+        self.last_flush = clock()
+        self.window_start = clock()
+        self.window_baseline = {}   # caller -> tokens used before the current budget window
+
+    def _shard(self):
+        shard = getattr(self.local, "counters", None)
+        if shard is None:
+            shard = self.local.counters = {}
+            with self.lock:
+                self._retire()
+                self.shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire(self):
+        # Folds the counters of threads that have exited into self.retired, so a process that keeps
+        # starting new threads doesn't keep a shard for each of them.  Call with self.lock held.
+        alive = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                continue
+            for key, row in shard.items():
+                total = self.retired.setdefault(key, [0, 0, 0, 0.0, 0, 0])
+                for i, value in enumerate(row):
+                    total[i] += value
+        self.shards = alive
+
+    def record(self, caller, route, model, input_tokens, output_tokens, seconds,
+               cache_read_tokens=0, cache_write_tokens=0):
+        shard = self._shard()
+        key = (caller or "anonymous", route or "-", model)
+        row = shard.get(key)
+        if row is None:
+            row = shard[key] = [0, 0, 0, 0.0, 0, 0]
+        row[0] += 1
+        row[1] += input_tokens or 0
+        row[2] += output_tokens or 0
+        row[3] += seconds
+        row[4] += cache_read_tokens or 0
+        row[5] += cache_write_tokens or 0
+        if self.sink and self.clock() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def totals(self):
+        # Adds up every thread's counters.  A row read while its thread is updating it
+        # is at most one call behind, and the next flush catches up.
+        with self.lock:
+            self._retire()
+            shards = [shard for _, shard in self.shards]
+            totals = {key: list(row) for key, row in self.retired.items()}
+        for shard in shards:
+            for key, row in list(shard.items()):
+                total = totals.setdefault(key, [0, 0, 0, 0.0, 0, 0])
+                for i, value in enumerate(row):
+                    total[i] += value
+        return totals
+
+    def flush(self):
+        # Sends what was used since the last flush to the sink, and returns those rows.
+        # If another thread is already flushing, this one doesn't wait for it.
+        if not self.flush_lock.acquire(blocking=False):
+            return []
+        try:
+            now = self.clock()
+            rows = []
+            for key, total in self.totals().items():
+                last = self.flushed.get(key, [0, 0, 0, 0.0, 0, 0])
+                calls, input_tokens, output_tokens, seconds, cache_read, cache_write = (t - l for t, l in zip(total, last))
+                if calls:
+                    rows.append({"caller": key[0], "route": key[1], "model": key[2], "calls": calls,
+                                 "input_tokens": input_tokens, "output_tokens": output_tokens,
+                                 "cache_read_tokens": cache_read, "cache_write_tokens": cache_write,
+                                 "seconds": round(seconds, 3)})
+                self.flushed[key] = total
+            self.last_flush = now
+            if rows and self.sink:
+                self.sink.write(rows, now)
+            return rows
+        finally:
+            self.flush_lock.release()
+
+    def _tokens_by_caller(self):
+        tokens = {}
+        for (caller, _, _), row in self.totals().items():
+            tokens[caller] = tokens.get(caller, 0) + row[1] + row[2] + row[4] + row[5]
+        return tokens
+
+    def used(self, caller):
+        # Tokens the caller has used in the current budget window
+        now = self.clock()
+        tokens = self._tokens_by_caller()
+        with self.lock:
+            if now - self.window_start >= self.budget_window:
+                self.window_start = now
+                self.window_baseline = tokens
+            return tokens.get(caller, 0) - self.window_baseline.get(caller, 0)
+
+    def check_budget(self, caller):
+        caller = caller or "anonymous"
+        budget = self.budgets.get(caller, self.budgets.get("*"))
+        if budget is not None:
+            used = self.used(caller)
+            if used >= budget:
+                raise BudgetExceeded(caller, used, budget)
+
+    def top(self, n=10):
+        # The most expensive (caller, route, model) combinations, by tokens per call:
+        rows = [{"caller": key[0], "route": key[1], "model": key[2], "calls": calls,
+                 "tokens_per_call": round((input_tokens + output_tokens + cache_read + cache_write) / calls, 1)}
+                for key, (calls, input_tokens, output_tokens, _, cache_read, cache_write) in self.totals().items() if calls]
+        return sorted(rows, key=lambda row: row["tokens_per_call"], reverse=True)[:n]
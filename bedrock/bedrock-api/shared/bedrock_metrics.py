@@ -0,0 +1,80 @@
+import json, os, sys, time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Hot-path instrumentation shared by the bedrock-api functions (deployed as the SharedLayer).
+# Each request's phase timings and token counts are printed as one CloudWatch Embedded Metric
+# Format (EMF) log line, which CloudWatch turns into metrics without any API calls, and are
+# also kept in small in-process histograms so every line carries this container's p50/p95/p99.
+
+namespace = "BedrockApi"
+cold_start = True
+histograms = defaultdict(lambda: deque(maxlen=1000))
+
+
+# Collects how long each phase of a request took, in milliseconds.
+# Timing the same phase more than once adds up (handy for per-chunk work like parsing).
+class PhaseTimer:
+
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, ms):
+        self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def count(self, name, value):
+        if value is not None:
+            self.counts[name] = value
+
+
+# Work done at import time (like creating clients) is only reported on the cold start:
+init_timer = PhaseTimer()
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {"p50": round(pick(0.50), 3), "p95": round(pick(0.95), 3), "p99": round(pick(0.99), 3)}
+
+
+def emit_metrics(timer, function_name=None, out=None):
+    global cold_start
+    function_name = function_name or os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+
+    phases = dict(timer.phases)
+    if cold_start:
+        phases.update({f"init_{name}": ms for name, ms in init_timer.phases.items()})
+
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in phases]
+                         + [{"Name": name, "Unit": "Count"} for name in timer.counts]
+                         + [{"Name": "ColdStart", "Unit": "Count"}],
+            }],
+        },
+        "FunctionName": function_name,
+        "ColdStart": 1 if cold_start else 0,
+    }
+    record.update({name: round(ms, 3) for name, ms in phases.items()})
+    record.update(timer.counts)
+
+    for name, ms in timer.phases.items():
+        histograms[name].append(ms)
+    record["Percentiles"] = {name: percentiles(values) for name, values in histograms.items()}
+
+    print(json.dumps(record), file=out or sys.stdout, flush=True)
+    cold_start = False
+    return record
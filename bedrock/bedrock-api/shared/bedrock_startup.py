@@ -0,0 +1,70 @@
+import json, os
+
+# Start-up helpers shared by the bedrock-api functions (deployed in the SharedLayer).
+#
+# Clients are expensive to build (endpoint resolution, credential lookup, loading the service
+# model), and the first request on a client also pays for a TLS handshake.  So each function
+# builds its clients once at import time, during the Lambda init phase, and then keeps their
+# connections alive.  A scheduled warm-up event opens the connection ahead of real traffic.
+# Since the clients (and boto3 with them) are built while the handler module is imported, a
+# warm-up invocation doesn't build anything: all it adds is the connection it opens.
+
+clients = {}
+
+
+def get_client(service='bedrock-runtime', endpoint_url=None, **config):
+    # Keyword arguments override the defaults below, e.g. retries={'total_max_attempts': 1};
+    # endpoint_url points the client at a local stand-in such as DynamoDB Local.
+    key = (service, endpoint_url, repr(sorted(config.items())))
+    if key not in clients:
+        import boto3
+        from botocore.config import Config
+        settings = dict(
+            tcp_keepalive=True,
+            max_pool_connections=int(os.environ.get('BEDROCK_MAX_POOL', '10')),
+            connect_timeout=float(os.environ.get('BEDROCK_CONNECT_TIMEOUT', '2')),
+            read_timeout=float(os.environ.get('BEDROCK_READ_TIMEOUT', '60')),
+        )
+        settings.update(config)
+        clients[key] = boto3.client(service, endpoint_url=endpoint_url, config=Config(**settings))
+    return clients[key]
+
+
+# Warm-up pings come from an EventBridge schedule (see the Warmup events in template.yaml):
+def is_warmup(event):
+    return bool(event) and (event.get('warmup') or event.get('source') == 'aws.events')
+
+
+def http_session(client):
+    # botocore has no public way to reach a client's connection pool, so this relies on a private
+    # attribute.  If a botocore upgrade moves it, say so loudly rather than as a failed warm-up.
+    session = getattr(getattr(client, '_endpoint', None), 'http_session', None)
+    if not callable(getattr(session, 'send', None)):
+        import botocore
+        raise RuntimeError(f"botocore {botocore.__version__} has no client._endpoint.http_session; "
+                           "bedrock_startup.prime needs updating")
+    return session
+
+
+def prime(client):
+    # Opens (or refreshes) a pooled TLS connection to the service endpoint without calling
+    # a model: an unsigned GET of the endpoint root goes through the client's own HTTP session,
+    # so the next real request reuses the connection.  Whatever status comes back is fine;
+    # only network errors count as a failed warm-up.
+    from botocore.awsrequest import AWSRequest
+    session = http_session(client)
+    try:
+        request = AWSRequest(method='GET', url=client.meta.endpoint_url).prepare()
+        session.send(request)
+        return True
+    except Exception as e:
+        print(f"warm-up could not reach {client.meta.endpoint_url}: {e}")
+        return False
+
+
+def warm_up(*clients_to_prime):
+    primed = all([prime(client) for client in clients_to_prime])
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"warmup": True, "primed": primed}),
+    }
@@ -0,0 +1,9 @@
+import os, sys
+
+# In Lambda the SharedLayer modules are on the python path; do the same for the tests.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "shared"))
+# ...and so are each function's own modules (app.py is imported as code_gen_<name>.app instead):
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "code_gen_image"))
+
+# Some functions create their clients at import time, which needs a region:
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,54 @@
+import base64, io, json
+
+import pytest
+
+import bedrock_metrics
+from bedrock_metrics import PhaseTimer, emit_metrics
+from code_gen_image import app as image_app
+
+
+def emf_lines(text):
+    return [json.loads(line) for line in text.splitlines() if line.startswith('{"_aws"')]
+
+
+# pytest's capsys swaps sys.stdout for a fake one, which is where the EMF lines go:
+@pytest.fixture()
+def fake_stdout(capsys, monkeypatch):
+    monkeypatch.setattr(bedrock_metrics, "cold_start", True)
+    monkeypatch.setattr(bedrock_metrics, "histograms", bedrock_metrics.defaultdict(list))
+    return capsys
+
+
+def test_emit_metrics_writes_emf_with_percentiles(fake_stdout):
+    for ms in range(1, 101):
+        timer = PhaseTimer()
+        timer.add("invoke", ms)
+        timer.count("output_tokens", 42)
+        emit_metrics(timer, function_name="GenerateText")
+
+    first, last = emf_lines(fake_stdout.readouterr().out)[::99]
+    metrics = {m["Name"]: m["Unit"] for m in last["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+
+    assert first["ColdStart"] == 1 and last["ColdStart"] == 0
+    assert metrics == {"invoke": "Milliseconds", "output_tokens": "Count", "ColdStart": "Count"}
+    assert last["FunctionName"] == "GenerateText"
+    assert last["invoke"] == 100 and last["output_tokens"] == 42
+    assert last["Percentiles"]["invoke"] == {"p50": 51, "p95": 96, "p99": 100}
+
+
+def test_image_handler_reports_each_phase(fake_stdout, monkeypatch):
+    png = base64.b64encode(b"png bytes").decode()
+
+    class FakeClient:
+        def invoke_model(self, **kwargs):
+            return {"body": io.BytesIO(json.dumps({"images": [png]}).encode())}
+
+    monkeypatch.setattr(image_app, "client", FakeClient())
+    monkeypatch.setattr(image_app, "cache", image_app.ImageCache())
+
+    response = image_app.lambda_handler({"queryStringParameters": {"prompt": "a cat"}}, None)
+
+    assert response["body"] == png
+    [record] = emf_lines(fake_stdout.readouterr().out)
+    for phase in ("serialize", "invoke", "read", "parse", "total"):
+        assert record[phase] >= 0
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import bedrock_startup
+from bedrock_startup import get_client, is_warmup
+from code_gen_image import app as image_app
+
+
+def test_get_client_builds_each_configuration_once():
+    client = get_client("bedrock-runtime", read_timeout=5)
+
+    assert get_client("bedrock-runtime", read_timeout=5) is client
+    assert get_client("bedrock-runtime", read_timeout=6) is not client
+    assert client.meta.config.tcp_keepalive is True
+    assert client.meta.config.read_timeout == 5
+
+
+def test_is_warmup():
+    assert is_warmup({"warmup": True})
+    assert is_warmup({"source": "aws.events", "detail-type": "Scheduled Event"})
+    assert not is_warmup({"queryStringParameters": {"prompt": "a cat"}})
+
+
+def test_warmup_event_primes_the_client_without_calling_the_model(monkeypatch):
+    primed = []
+
+    class NoModelClient:
+        def invoke_model(self, **kwargs):
+            raise AssertionError("a warm-up must not call the model")
+
+    monkeypatch.setattr(image_app, "client", NoModelClient())
+    monkeypatch.setattr(bedrock_startup, "prime", lambda client: primed.append(client) or True)
+
+    response = image_app.lambda_handler({"warmup": True}, None)
+
+    assert json.loads(response["body"]) == {"warmup": True, "primed": True}
+    assert primed == [image_app.client]
+
+
+def test_prime_reports_network_errors_but_not_a_missing_http_session():
+    unreachable = get_client("bedrock-runtime", endpoint_url="http://127.0.0.1:9", connect_timeout=1)
+    assert bedrock_startup.prime(unreachable) is False
+
+    class OtherClient:
+        pass
+
+    with pytest.raises(RuntimeError, match="http_session"):
+        bedrock_startup.prime(OtherClient())
@@ -0,0 +1,283 @@
+import base64, io, json, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+from code_gen_image import app as image_app
+from image_cache import ImageCache, DiskTier, S3Tier, image_key, etag_for
+
+
+class FakeImageClient:
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        body = json.loads(kwargs["body"])
+        config = body["imageGenerationConfig"]
+        if (config["width"], config["height"]) not in image_app.supported_sizes:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "unsupported size"}}, "InvokeModel")
+        prompt = body["textToImageParams"]["text"]
+        png = f"{config['width']}x{config['height']} png of {prompt}, seed {config['seed']}"
+        image = base64.b64encode(png.encode()).decode()
+        return {"body": io.BytesIO(json.dumps({"images": [image]}).encode())}
+
+
+# Just enough of the S3 client for the cache tier (moto's mock_aws works too, see below):
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?expires={ExpiresIn}"
+
+
+@pytest.fixture()
+def image_client(monkeypatch, tmp_path, capsys):
+    fake = FakeImageClient()
+    monkeypatch.setattr(image_app, "client", fake)
+    monkeypatch.setattr(image_app, "cache", ImageCache(DiskTier(str(tmp_path / "images"))))
+    monkeypatch.setattr(image_app, "rendering", {})
+    return fake
+
+
+def get_image(prompt, headers=None, **query):
+    return image_app.lambda_handler({"queryStringParameters": dict(query, prompt=prompt), "headers": headers or {}}, None)
+
+
+def test_key_covers_every_generation_setting():
+    key = image_key("titan", "a  cat", 0, 8, 512, 512, "standard")
+
+    assert key == image_key("titan", "a cat", 0, 8, 512, 512, "standard")
+    assert key != image_key("titan", "a cat", 1, 8, 512, 512, "standard")
+    assert key != image_key("titan", "a cat", 0, 8, 512, 512, "premium")
+
+
+def test_repeat_requests_come_from_the_cache_with_the_same_etag(image_client):
+    first = get_image("a cat")
+    second = get_image("a  cat")
+
+    assert image_client.calls == 1
+    assert (first["headers"]["X-Cache"], second["headers"]["X-Cache"]) == ("MISS", "HIT")
+    assert first["body"] == second["body"] and base64.b64decode(second["body"]) == b"512x512 png of a cat, seed 0"
+    assert first["headers"]["ETag"] == second["headers"]["ETag"]
+
+
+def test_if_none_match_gets_a_304_without_generating(image_client):
+    etag = get_image("a dog")["headers"]["ETag"]
+
+    for header in (etag, f'"other", W/{etag}', "*"):
+        response = get_image("a dog", {"If-None-Match": header})
+        assert response["statusCode"] == 304 and response["body"] == ""
+    assert get_image("a dog", {"if-none-match": '"other"'})["statusCode"] == 200
+    assert image_client.calls == 1
+
+
+def test_disk_tier_evicts_least_recently_used_and_reloads(tmp_path):
+    disk = DiskTier(str(tmp_path), max_bytes=10)
+    disk.put("a", b"1234")
+    disk.put("b", b"5678")
+    disk.get("a")
+    disk.put("c", b"90ab")
+
+    assert disk.get("b") is None
+    assert (disk.get("a"), disk.get("c")) == (b"1234", b"90ab")
+    assert sorted(DiskTier(str(tmp_path), max_bytes=10).entries) == ["a", "c"]
+
+
+def test_disk_tier_handles_concurrent_writes_of_the_same_key(tmp_path):
+    disk = DiskTier(str(tmp_path))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: disk.put("k", b"png" * 1000), range(64)))
+
+    assert disk.get("k") == b"png" * 1000
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["k"]
+
+
+def test_s3_tier_is_shared_and_promoted_to_disk(tmp_path):
+    s3 = FakeS3()
+    ImageCache(DiskTier(str(tmp_path / "one")), S3Tier("images-bucket", s3=s3)).put("k", b"png")
+    other = ImageCache(DiskTier(str(tmp_path / "two")), S3Tier("images-bucket", s3=s3))
+
+    assert other.get("k") == b"png" and other.get("k") == b"png"
+    assert other.get("missing") is None
+    assert other.stats() == {"disk_hits": 1, "s3_hits": 1, "misses": 1}
+
+
+def test_s3_tier_with_moto():
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="images-bucket")
+        tier = S3Tier("images-bucket", s3=s3)
+        tier.put("k", b"png")
+
+        assert tier.get("k") == b"png"
+        assert tier.get("missing") is None
+
+
+def test_variants_are_generated_concurrently_and_bundled(image_client):
+    image_client.delay = 0.1
+    response = get_image("a cat", seeds="1,2", sizes="512x512, 1024x1024")
+    result = json.loads(response["body"])
+
+    assert response["statusCode"] == 200 and image_client.calls == 4
+    assert [(v["seed"], v["width"], v["height"]) for v in result["variants"]] == [
+        (1, 512, 512), (1, 1024, 1024), (2, 512, 512), (2, 1024, 1024)]
+    assert base64.b64decode(result["variants"][1]["image"]) == b"1024x1024 png of a cat, seed 1"
+    assert all(v["cache"] == "MISS" and v["latency_ms"] >= 100 for v in result["variants"])
+    assert result["speedup"] > 2
+
+    again = json.loads(get_image("a cat", seeds="2", sizes="1024x1024")["body"])["variants"][0]
+    assert again["cache"] == "HIT" and again["etag"] == result["variants"][3]["etag"]
+
+
+def test_variants_link_to_s3_when_it_is_on(image_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(image_app, "cache", ImageCache(DiskTier(str(tmp_path / "images")), S3Tier("images-bucket", s3=FakeS3())))
+
+    [variant] = json.loads(get_image("a cat", seeds="7")["body"])["variants"]
+    assert variant["url"].startswith("https://images-bucket.s3.amazonaws.com/images/") and "image" not in variant
+
+    [variant] = json.loads(get_image("a cat", seeds="7", bundle="1")["body"])["variants"]
+    assert "image" in variant
+
+
+def test_variants_reject_bad_sizes_and_too_many_variants(image_client):
+    assert get_image("a cat", sizes="big")["statusCode"] == 400
+    assert get_image("a cat", sizes="300x300")["statusCode"] == 400
+    assert get_image("a cat", seeds=",".join(map(str, range(9))))["statusCode"] == 400
+    assert image_client.calls == 0
+
+
+# Stands in for Pillow, so the handler's side of transcoding can be tested without it:
+@pytest.fixture()
+def fake_transcoder(image_client, monkeypatch):
+    import transcode
+    monkeypatch.setattr(transcode, "Image", object())
+    monkeypatch.setattr(image_app, "transcode", lambda png, tier, image_format: f"{image_format} {tier} of {png.decode()}".encode())
+
+
+def test_format_comes_from_accept_and_renditions_are_cached(fake_transcoder, image_client):
+    response = get_image("a cat", {"Accept": "image/avif,image/webp,*/*;q=0.8"}, size="thumbnail")
+    image_app.background.submit(lambda: None).result()    # let the other renditions finish
+
+    assert response["headers"]["Content-Type"] == "image/webp" and response["headers"]["Vary"] == "Accept"
+    body = base64.b64decode(response["body"])
+    assert body == b"webp thumbnail of 512x512 png of a cat, seed 0"
+    assert response["headers"]["Content-Length"] == str(len(body))
+
+    jpeg = get_image("a cat", {"accept": "image/jpeg"}, size="medium")
+    assert jpeg["headers"]["X-Cache"] == "HIT" and base64.b64decode(jpeg["body"]).startswith(b"jpeg medium")
+    assert jpeg["headers"]["ETag"] != response["headers"]["ETag"]
+    assert get_image("a cat", {"Accept": "image/webp;q=0"})["headers"]["Content-Type"] == "image/png"
+    assert image_client.calls == 1
+
+
+def test_accept_parsing_tolerates_spacing_and_bad_quality_values(fake_transcoder):
+    from transcode import choose_format
+
+    assert choose_format("image/webp; q=0, image/jpeg ; Q=0.5") == "jpeg"
+    assert choose_format("image/webp;q=high, image/jpeg;level=1") == "jpeg"
+    assert choose_format("image/webp;q=, ;;, image/png") == "png"
+    assert choose_format(None) == "png"
+
+
+def test_without_pillow_the_original_png_is_served(image_client):
+    response = get_image("a cat", {"Accept": "image/webp"}, size="thumbnail")
+
+    assert response["headers"]["Content-Type"] == "image/png"
+    assert base64.b64decode(response["body"]) == b"512x512 png of a cat, seed 0"
+    assert get_image("a cat", size="huge")["statusCode"] == 400
+
+
+def test_transcode_shrinks_and_resizes():
+    Image = pytest.importorskip("PIL.Image")
+    import transcode
+
+    png = io.BytesIO()
+    Image.effect_noise((1024, 1024), 64).convert("RGB").save(png, "PNG")
+    png = png.getvalue()
+
+    thumbnail = Image.open(io.BytesIO(transcode.transcode(png, "thumbnail", "webp")))
+    assert (thumbnail.format, thumbnail.size) == ("WEBP", (128, 128))
+    assert len(transcode.transcode(png, "full", "jpeg")) < len(png)
+
+
+def test_progressive_returns_a_preview_then_the_full_image_on_poll(image_client):
+    response = get_image("a cat", progressive="1")
+    preview = json.loads(response["body"])
+
+    assert response["statusCode"] == 202 and preview["status"] == "PENDING"
+    assert base64.b64decode(preview["image"]) == b"512x512 png of a cat, seed 0"
+
+    image_app.background.submit(lambda: None).result()    # let the full-size image finish
+    full = image_app.lambda_handler({"queryStringParameters": {"job": preview["job"]}}, None)
+    assert full["statusCode"] == 200 and full["headers"]["ETag"] == etag_for(image_key(image_app.ModelId, "a cat", 0, 8, 1024, 1024, "standard"))
+    assert base64.b64decode(full["body"]) == b"1024x1024 png of a cat, seed 0"
+
+    # Once it's cached, progressive requests get the full image straight away:
+    again = get_image("a cat", progressive="1")
+    assert again["statusCode"] == 200 and json.loads(again["body"])["width"] == 1024
+    assert image_client.calls == 2
+
+
+def test_progressive_starts_one_render_per_image(image_client, monkeypatch):
+    renders, original = [], image_app.cached_image
+    monkeypatch.setattr(image_app, "cached_image",
+                        lambda prompt, timer=None, **config: renders.append(config["width"]) or original(prompt, timer, **config))
+    gate = threading.Event()
+    image_app.background.submit(gate.wait)    # hold the background thread until both requests are in
+    jobs = {json.loads(get_image("a cat", progressive="1")["body"])["job"] for _ in range(2)}
+    gate.set()
+    image_app.background.submit(lambda: None).result()
+
+    assert len(jobs) == 1 and renders.count(1024) == 1
+    assert image_app.rendering == {}
+
+
+def test_progressive_without_a_cache_tier_answers_with_the_full_image(image_client, monkeypatch):
+    monkeypatch.setattr(image_app, "cache", ImageCache())
+    response = get_image("a cat", progressive="1")
+
+    assert response["statusCode"] == 200 and json.loads(response["body"])["status"] == "COMPLETE"
+    assert base64.b64decode(json.loads(response["body"])["image"]) == b"1024x1024 png of a cat, seed 0"
+    assert image_client.calls == 1
+
+
+def test_poll_is_pending_until_the_image_exists(image_client):
+    pending = image_app.lambda_handler({"queryStringParameters": {"job": "0" * 64}}, None)
+
+    assert pending["statusCode"] == 202 and pending["headers"]["Retry-After"] == "2"
+    assert image_app.lambda_handler({"queryStringParameters": {"job": "../etc/passwd"}}, None)["statusCode"] == 400
+
+
+def test_progressive_in_lambda_renders_in_an_async_invocation(image_client, monkeypatch, tmp_path):
+    invocations = []
+
+    class FakeLambda:
+        def invoke(self, **kwargs):
+            invocations.append(kwargs)
+
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "GenerateImage")
+    monkeypatch.setattr(image_app, "get_client", lambda service: FakeLambda())
+    monkeypatch.setattr(image_app, "cache", ImageCache(DiskTier(str(tmp_path / "images")), S3Tier("images-bucket", s3=FakeS3())))
+
+    job = json.loads(get_image("a cat", progressive="1")["body"])["job"]
+    [invocation] = invocations
+    assert (invocation["FunctionName"], invocation["InvocationType"]) == ("GenerateImage", "Event")
+
+    image_app.lambda_handler(json.loads(invocation["Payload"]), None)
+    assert image_app.lambda_handler({"queryStringParameters": {"job": job}}, None)["statusCode"] == 200
@@ -0,0 +1,34 @@
+import base64, io, json, os
+
+import pytest
+
+from image_decode import iter_image_bytes, ImageDecodeError
+
+
+def titan_body(png, **dumps):
+    return json.dumps({"images": [base64.b64encode(png).decode()], "error": None}, **dumps).encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_decodes_the_first_image_in_chunks(chunk_size):
+    png = os.urandom(10_001)
+    body = io.BytesIO(titan_body(png))
+
+    pieces = list(iter_image_bytes(body, chunk_size))
+
+    assert b"".join(pieces) == png
+    assert max(len(piece) for piece in pieces) <= max(chunk_size, 3)
+    assert body.read() == b""     # read to the end, so the connection can be reused
+
+
+def test_handles_whitespace_and_escaped_slashes():
+    png = bytes(range(256)) * 10
+    body = titan_body(png, indent=2).replace(b"/", b"\\/")
+
+    assert b"".join(iter_image_bytes(io.BytesIO(body), 5)) == png
+
+
+@pytest.mark.parametrize("body", [b'{"error": "blocked"}', b'{"images": [], "error": "blocked"}', b'{"images": ["QUJD'])
+def test_bad_responses_raise(body):
+    with pytest.raises(ImageDecodeError):
+        b"".join(iter_image_bytes(io.BytesIO(body), 4))
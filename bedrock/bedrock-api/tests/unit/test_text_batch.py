@@ -0,0 +1,77 @@
+import base64, gzip, json, time
+
+import pytest
+
+from code_gen_text import app
+
+
+@pytest.fixture()
+def slow_model(monkeypatch):
+    # Longer prompts take longer to answer; "fail" fails
+    def call_bedrock(prompt, timer=None, caller=None, route=None):
+        if prompt == "fail":
+            raise RuntimeError("model error")
+        time.sleep(len(prompt) / 100)
+        return prompt.upper()
+    monkeypatch.setattr(app, "call_bedrock", call_bedrock)
+
+
+def post(prompts, headers=None, encode=True):
+    body = json.dumps(prompts)
+    return app.lambda_handler({
+        "httpMethod": "POST",
+        "headers": headers or {},
+        "body": base64.b64encode(body.encode()).decode() if encode else body,
+        "isBase64Encoded": encode,
+    }, None)
+
+
+def test_batch_answers_each_prompt_in_completion_order(slow_model, capsys):
+    response = post(["a much longer prompt", "fail", "hi"])
+
+    lines = [json.loads(line) for line in response["body"].splitlines()]
+    assert response["statusCode"] == 200
+    assert response["headers"]["Content-Type"] == "application/x-ndjson"
+    assert [line["index"] for line in lines] == [1, 2, 0]
+    assert lines[1] == {"index": 2, "prompt": "hi", "response": "HI"}
+    assert lines[0]["error"] == "model error"
+
+
+def test_batch_is_gzipped_when_the_client_accepts_it(slow_model, capsys):
+    response = post(["one", "two"], headers={"accept-encoding": "br, gzip;q=0.8"}, encode=False)
+
+    assert response["headers"]["Content-Encoding"] == "gzip"
+    assert response["isBase64Encoded"]
+    body = gzip.decompress(base64.b64decode(response["body"])).decode()
+    assert sorted(json.loads(line)["response"] for line in body.splitlines()) == ["ONE", "TWO"]
+
+    assert not app.accepts_gzip({"Accept-Encoding": "gzip;q=0, identity"})
+    assert not app.accepts_gzip({"Accept-Encoding": "gzip; q=0"})
+    assert not app.accepts_gzip({"Accept-Encoding": "gzip;q=lots"})
+    assert app.accepts_gzip({"accept-encoding": "br;q=x, GZIP ; Q=0.5"})
+
+
+def test_batch_rejects_anything_but_a_list_of_prompts(slow_model):
+    assert post({"prompt": "hi"})["statusCode"] == 400
+    assert post([])["statusCode"] == 400
+    assert post(["hi"] * (app.max_batch_size + 1))["statusCode"] == 400
+
+
+def test_text_meters_tokens_per_tenant_and_enforces_budgets(monkeypatch, capsys):
+    class FakeStream:
+        def invoke_model_with_response_stream(self, **kwargs):
+            chunks = [{"outputText": "Hi ", "inputTextTokenCount": 3}, {"outputText": "there.", "totalOutputTextTokenCount": 2}]
+            return {"body": [{"chunk": {"bytes": json.dumps(chunk).encode()}} for chunk in chunks]}
+
+    meter = app.Meter(budgets={"acme": 8})
+    monkeypatch.setattr(app, "client", FakeStream())
+    monkeypatch.setattr(app, "meter", meter)
+    monkeypatch.setattr(app, "cache", app.ResponseCache(max_entries=0))     # every call goes to the model
+    event = {"queryStringParameters": {"prompt": "hello"}, "headers": {"X-Tenant-Id": "acme"}, "resource": "/text"}
+
+    assert app.lambda_handler(event, None)["statusCode"] == 200
+    assert app.lambda_handler(event, None)["statusCode"] == 200
+    assert app.lambda_handler(event, None)["statusCode"] == 429
+
+    [row] = meter.flush()
+    assert (row["caller"], row["route"], row["calls"], row["input_tokens"], row["output_tokens"]) == ("acme", "/text", 2, 6, 4)
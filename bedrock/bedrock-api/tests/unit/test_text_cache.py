@@ -0,0 +1,72 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from bedrock_cache import ResponseCache
+from code_gen_text import app
+
+
+# Streams a canned answer, like invoke_model_with_response_stream:
+class FakeStreamClient:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.calls += 1
+        chunks = [{"outputText": "The Moon.", "inputTextTokenCount": 7, "totalOutputTextTokenCount": 3}]
+        return {"body": [{"chunk": {"bytes": json.dumps(chunk).encode()}} for chunk in chunks]}
+
+
+@pytest.fixture()
+def fake_client(monkeypatch):
+    fake = FakeStreamClient()
+    monkeypatch.setattr(app, "client", fake)
+    monkeypatch.setattr(app, "cache", ResponseCache())
+    return fake
+
+
+def get_text(prompt):
+    return app.lambda_handler({"queryStringParameters": {"prompt": prompt}}, None)
+
+
+def test_repeated_prompts_are_answered_from_the_cache(fake_client, capsys):
+    first = get_text("What is the Earth's natural satellite called?")
+    second = get_text("What is the  Earth's natural satellite called? ")
+
+    assert (first["headers"]["X-Cache"], second["headers"]["X-Cache"]) == ("MISS", "HIT")
+    assert json.loads(second["body"])["response"] == "The Moon."
+    assert fake_client.calls == 1
+    stats = json.loads(second["body"])["cache"]
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    metrics = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["cache_hit"] for line in metrics] == [0, 1]
+
+
+def test_cached_answers_are_not_charged_to_the_budget(fake_client, monkeypatch):
+    monkeypatch.setattr(app, "meter", app.Meter(budgets={"*": 10}))
+    assert get_text("moon?")["statusCode"] == 200
+
+    assert get_text("moon?")["statusCode"] == 200
+    assert get_text("sun?")["statusCode"] == 429
+
+
+def test_streams_are_retried_until_the_first_chunk_and_metered(fake_client, monkeypatch):
+    attempts = []
+    stream = fake_client.invoke_model_with_response_stream
+
+    def throttle_once(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, "InvokeModelWithResponseStream")
+        return stream(**kwargs)
+
+    monkeypatch.setattr(fake_client, "invoke_model_with_response_stream", throttle_once)
+    monkeypatch.setattr(app, "meter", app.Meter())
+    monkeypatch.setattr(app, "limiter", app.AdaptiveLimiter())
+
+    assert "".join(app.stream_metered("moon?", "acme", "/")) == "The Moon."
+    assert len(attempts) == 2 and app.limiter.metrics()["in_flight"] == 0
+    [row] = app.meter.flush()
+    assert (row["caller"], row["calls"], row["input_tokens"], row["output_tokens"]) == ("acme", 1, 7, 3)
@@ -0,0 +1,81 @@
+import base64, json
+
+import pytest
+
+from code_gen_text import jobs
+
+
+# Just enough of the DynamoDB client for the jobs table (DynamoDB Local works too,
+# with JOBS_TABLE_ENDPOINT=http://localhost:8000):
+class FakeDynamoDB:
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item):
+        self.items[Item["job_id"]["S"]] = Item
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.items.get(Key["job_id"]["S"])
+        return {"Item": item} if item else {}
+
+
+@pytest.fixture()
+def jobs_table(monkeypatch):
+    table = FakeDynamoDB()
+    dispatched = []
+    monkeypatch.setattr(jobs, "dynamodb", table)
+    monkeypatch.setattr(jobs, "dispatch", dispatched.append)
+    return dispatched
+
+
+def get_job(job_id):
+    response = jobs.status_handler({"pathParameters": {"id": job_id}}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_submit_then_poll_for_the_answer(jobs_table, monkeypatch):
+    generated = []
+    monkeypatch.setattr(jobs, "generate", lambda prompt, caller=None: generated.append(caller) or f"answer to {prompt}")
+
+    submitted = jobs.submit_handler({"body": json.dumps({"prompt": "why is the sky blue?"}),
+                                     "headers": {"X-Tenant-Id": "acme"}}, None)
+    job_id = json.loads(submitted["body"])["job_id"]
+
+    assert submitted["statusCode"] == 202
+    assert submitted["headers"]["Location"] == f"/text/jobs/{job_id}"
+    assert get_job(job_id)[1]["status"] == "PENDING"
+
+    # What the asynchronously invoked worker function would do:
+    [payload] = jobs_table
+    assert jobs.worker_handler(payload, None) == {"job_id": job_id, "status": "COMPLETE"}
+
+    status, job = get_job(job_id)
+    assert status == 200
+    assert job["response"] == "answer to why is the sky blue?"
+    assert job["updated_at"] >= job["created_at"]
+    assert job["caller"] == "acme" and generated == ["acme"]
+
+
+def test_failed_generation_is_recorded(jobs_table, monkeypatch):
+    def fail(prompt, caller=None):
+        raise TimeoutError("model took too long")
+
+    monkeypatch.setattr(jobs, "generate", fail)
+    job_id = json.loads(jobs.submit_handler({"queryStringParameters": {"prompt": "hi"}}, None)["body"])["job_id"]
+    jobs.worker_handler(jobs_table[0], None)
+
+    status, job = get_job(job_id)
+    assert job["status"] == "FAILED" and "model took too long" in job["error"]
+    assert get_job("no-such-job")[0] == 404
+
+
+def test_submit_accepts_base64_bodies_and_rejects_bad_ones(jobs_table):
+    body = base64.b64encode(json.dumps({"prompt": "why is the sky blue?"}).encode()).decode()
+
+    submitted = jobs.submit_handler({"body": body, "isBase64Encoded": True}, None)
+    assert submitted["statusCode"] == 202
+    assert jobs_table[0]["prompt"] == "why is the sky blue?"
+
+    for bad in ({"body": "{not json"}, {"body": "[1, 2]"}, {"body": "%%%", "isBase64Encoded": True}):
+        assert jobs.submit_handler(bad, None)["statusCode"] == 400
+    assert len(jobs_table) == 1
@@ -0,0 +1,130 @@
+import json, time, uuid
+
+import boto3
+
+from bedrock_text_gen import build_body, parse_response, modelId
+
+
+# Batch mode for very large prompt sets: instead of one invoke_model call per prompt, the prompts
+# are written to S3 as Bedrock batch inference records, Bedrock runs them as model invocation
+# jobs (cheaper than on-demand, and not subject to the on-demand rate limits), and the results
+# are read back from S3.  Jobs can take hours, so this is for offline work.
+#
+# Each job needs an IAM service role that Bedrock can assume to read and write the bucket, and
+# most models need at least 100 records per job (min_records_per_job): a short last shard is
+# shared with the one before it, and a run with fewer prompts than that is padded.  Records are built with build_body, so they
+# are exactly what call_bedrock would have sent.
+
+finished_states = ("Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired")
+
+
+def write_shard(s3, bucket, key, records):
+    data = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+    s3.put_object(Bucket=bucket, Key=key, Body=data)
+
+
+def submit_job(bedrock, name, role_arn, input_uri, output_uri):
+    return bedrock.create_model_invocation_job(
+        jobName=name,
+        roleArn=role_arn,
+        modelId=modelId,
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri, "s3InputFormat": "JSONL"}},
+        outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}},
+    )["jobArn"]
+
+
+def wait_for_job(bedrock, job_arn, poll_seconds, sleep=time.sleep):
+    while True:
+        job = bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+        if job["status"] in finished_states:
+            if job["status"] not in ("Completed", "PartiallyCompleted"):
+                raise RuntimeError(f"batch job {job_arn} ended {job['status']}: {job.get('message', '')}")
+            return job
+        sleep(poll_seconds)
+
+
+def read_results(s3, bucket, key, first_index, count):
+
+    # Output lines come back in any order, each with the recordId we gave it (its input index).
+    # A record the model couldn't answer has an "error" instead of a "modelOutput".
+    results = [RuntimeError("no output for this record")] * count
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    for line in body.iter_lines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        index = int(record["recordId"]) - first_index
+        if not 0 <= index < count:
+            continue    # padding
+        if "modelOutput" in record:
+            results[index] = parse_response(record["modelOutput"])
+        else:
+            results[index] = RuntimeError(str(record.get("error", "unknown error")))
+    return results
+
+
+def call_bedrock_batch(prompts, bucket, role_arn, prefix="bedrock-batch", records_per_job=10_000,
+                       min_records_per_job=100, poll_seconds=60, s3=None, bedrock=None, sleep=time.sleep):
+
+    # A generator: submits a job for every records_per_job prompts, then yields the answers in
+    # the same order as the prompts, one job at a time.  Like call_bedrock_many, a prompt that
+    # failed (or whose whole job failed) gets an exception in its place instead of an answer.
+    if records_per_job < min_records_per_job:
+        raise ValueError(f"records_per_job must be at least min_records_per_job ({min_records_per_job})")
+    s3 = s3 or boto3.client("s3")
+    bedrock = bedrock or boto3.client("bedrock")
+    run = f"{prefix}/{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    jobs = []   # (job arn or the exception submitting it raised, shard key, first index, record count)
+
+    def submit(shard, count=None):
+        number = len(jobs)
+        key = f"{run}/input/shard-{number:05d}.jsonl"
+        try:
+            write_shard(s3, bucket, key, shard)
+            job_arn = submit_job(bedrock, f"{run.rsplit('/', 1)[-1]}-{number}", role_arn,
+                                 f"s3://{bucket}/{key}", f"s3://{bucket}/{run}/output/")
+        except Exception as e:
+            job_arn = e
+        jobs.append((job_arn, key, int(shard[0]["recordId"]), count or len(shard)))
+
+    # The last full shard is held back until we know what comes after it, so that a short
+    # leftover can be shared with it rather than going out as a job under the minimum:
+    held, shard = None, []
+    for index, prompt in enumerate(prompts):
+        shard.append({"recordId": f"{index:011d}", "modelInput": build_body(prompt)})
+        if len(shard) == records_per_job:
+            if held:
+                submit(held)
+            held, shard = shard, []
+
+    if held and 0 < len(shard) < min_records_per_job:
+        rest = held + shard
+        if len(rest) >= 2 * min_records_per_job:
+            submit(rest[:-min_records_per_job])
+            submit(rest[-min_records_per_job:])
+        else:
+            submit(rest)    # a little over records_per_job, rather than one job under the minimum
+    else:
+        if held:
+            submit(held)
+        if shard and len(shard) < min_records_per_job:
+            # Fewer prompts than one job needs: pad with repeats, whose answers are dropped
+            count, end = len(shard), int(shard[-1]["recordId"]) + 1
+            padding = [{"recordId": f"{end + i:011d}", "modelInput": shard[i % count]["modelInput"]}
+                       for i in range(min_records_per_job - count)]
+            submit(shard + padding, count)
+        elif shard:
+            submit(shard)
+
+    # Results land at <output uri>/<job id>/<input file name>.out
+    for job_arn, key, first_index, count in jobs:
+        try:
+            if isinstance(job_arn, Exception):
+                raise job_arn
+            wait_for_job(bedrock, job_arn, poll_seconds, sleep)
+            output_key = f"{run}/output/{job_arn.rsplit('/', 1)[-1]}/{key.rsplit('/', 1)[-1]}.out"
+            results = read_results(s3, bucket, output_key, first_index, count)
+        except Exception as e:
+            results = [e] * count
+        yield from results
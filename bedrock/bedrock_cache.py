@@ -0,0 +1 @@
+bedrock-api/shared/bedrock_cache.py
\ No newline at end of file
@@ -0,0 +1,200 @@
+import argparse, base64, binascii, json, math, random, re, struct, threading, time, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+# Local stand-in for the bedrock-runtime endpoints this project uses, for load and latency testing
+# without paying for model calls:
+#   POST /model/{modelId}/invoke                     (Titan text and Titan image generator)
+#   POST /model/{modelId}/invoke-with-response-stream (Titan text, as an AWS event stream)
+#
+# Point boto3 at it with endpoint_url, or for the whole process with
+#   AWS_ENDPOINT_URL_BEDROCK_RUNTIME=http://localhost:8123
+# (any credentials will do, it doesn't check signatures).
+#
+# Latency is drawn from a lognormal distribution around --latency-median seconds; streamed answers
+# arrive a word at a time with --chunk-delay between them.  --throttle-rate answers that fraction
+# of calls with a ThrottlingException, and --max-concurrency throttles calls above that many at once,
+# like an account quota would.  --answers is a JSON file of {"text in the prompt": "canned answer"}.
+#
+#   python bedrock_emulator.py --port 8123 --latency-median 0.8 --throttle-rate 0.02
+
+
+default_answer = "This is a canned answer from the local Bedrock emulator."
+
+
+class EmulatorSettings:
+
+    def __init__(self, latency_median=0.5, latency_sigma=0.4, chunk_delay=0.02, throttle_rate=0.0,
+                 max_concurrency=0, answers=None, seed=None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.chunk_delay = chunk_delay
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.answers = answers or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+
+    def latency(self):
+        if self.latency_median <= 0:
+            return 0.0
+        with self.lock:
+            return self.random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+    def answer_for(self, prompt):
+        for text, answer in self.answers.items():
+            if text.lower() in prompt.lower():
+                return answer
+        return default_answer
+
+
+# A PNG of the requested size, so image callers get a real (if plain) picture back:
+def make_png(width, height, seed=0):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    color = bytes([(seed * 37) % 256, (seed * 91 + 80) % 256, (seed * 53 + 160) % 256])
+    raw = b"".join(b"\x00" + color * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+
+# One message in the AWS event stream framing used by invoke_model_with_response_stream:
+# total length, headers length and a CRC of those two, then the headers, the payload and a CRC of it all.
+def event_message(headers, payload):
+    encoded = b""
+    for name, value in headers.items():
+        name, value = name.encode(), value.encode()
+        encoded += struct.pack(">B", len(name)) + name + b"\x07" + struct.pack(">H", len(value)) + value
+    prelude = struct.pack(">II", 12 + len(encoded) + len(payload) + 4, len(encoded))
+    message = prelude + struct.pack(">I", binascii.crc32(prelude)) + encoded + payload
+    return message + struct.pack(">I", binascii.crc32(message))
+
+
+def chunk_event(data):
+    payload = json.dumps({"bytes": base64.b64encode(json.dumps(data).encode()).decode()}).encode()
+    return event_message({":event-type": "chunk", ":content-type": "application/json", ":message-type": "event"}, payload)
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = EmulatorSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        match = re.fullmatch(r"/model/([^/]+)/(invoke|invoke-with-response-stream)", self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not match:
+            return self.send_json(404, {"message": f"unknown path {self.path}"}, "ResourceNotFoundException")
+        model_id, operation = unquote(match.group(1)), match.group(2)
+
+        settings = self.settings
+        with settings.lock:
+            settings.calls += 1
+            over_quota = settings.max_concurrency and settings.in_flight >= settings.max_concurrency
+            throttle = over_quota or settings.random.random() < settings.throttle_rate
+            if throttle:
+                settings.throttled += 1
+            else:
+                settings.in_flight += 1
+        if throttle:
+            return self.send_json(429, {"message": "Too many requests, please wait before trying again."},
+                                  "ThrottlingException")
+        try:
+            time.sleep(settings.latency())
+            if "image" in model_id:
+                self.invoke_image(body)
+            elif operation == "invoke":
+                self.invoke_text(body)
+            else:
+                self.stream_text(body)
+        finally:
+            with settings.lock:
+                settings.in_flight -= 1
+
+    def send_json(self, status, data, error_type=None):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if error_type:
+            self.send_header("x-amzn-ErrorType", error_type)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def invoke_text(self, body):
+        prompt = body.get("inputText", "")
+        answer = self.settings.answer_for(prompt)
+        self.send_json(200, {
+            "inputTextTokenCount": count_tokens(prompt),
+            "results": [{"tokenCount": count_tokens(answer), "outputText": answer, "completionReason": "FINISH"}],
+        })
+
+    def invoke_image(self, body):
+        config = body.get("imageGenerationConfig", {})
+        png = make_png(config.get("width", 512), config.get("height", 512), config.get("seed", 0))
+        image = base64.b64encode(png).decode()
+        self.send_json(200, {"images": [image] * config.get("numberOfImages", 1), "error": None})
+
+    def stream_text(self, body):
+        prompt = body.get("inputText", "")
+        answer = self.settings.answer_for(prompt)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = re.findall(r"\S+\s*", answer) or [""]
+        for i, word in enumerate(words):
+            data = {"outputText": word, "index": 0, "totalOutputTextTokenCount": None, "completionReason": None,
+                    "inputTextTokenCount": count_tokens(prompt) if i == 0 else None}
+            if i == len(words) - 1:
+                data.update(totalOutputTextTokenCount=count_tokens(answer), completionReason="FINISH")
+            self.write_chunk(chunk_event(data))
+            time.sleep(self.settings.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def start_emulator(port=0, settings=None):
+    # Runs the emulator on a background thread; returns the server (its URL is server.url).
+    handler = type("Handler", (EmulatorHandler,), {"settings": settings or EmulatorSettings()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.settings = handler.settings
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the bedrock-runtime API")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--latency-median", type=float, default=0.5, help="median seconds before answering")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="spread of the lognormal latency")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed words")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls to throttle")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="throttle calls above this many at once")
+    parser.add_argument("--answers", help='JSON file of {"text in the prompt": "canned answer"}')
+    args = parser.parse_args()
+
+    answers = json.load(open(args.answers)) if args.answers else {}
+    settings = EmulatorSettings(args.latency_median, args.latency_sigma, args.chunk_delay,
+                                args.throttle_rate, args.max_concurrency, answers)
+    server = start_emulator(args.port, settings)
+    print(f"Bedrock emulator listening on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
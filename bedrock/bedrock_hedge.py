@@ -0,0 +1,95 @@
+import threading, time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# Hedged requests: if a call hasn't answered by the time most calls have (a percentile of recent
+# latencies), send the same request again and take whichever answer comes back first.
+# Slow model replicas then only cost us the hedge delay instead of the whole p99.
+#
+# The first attempt runs on a thread of its own (not the pool, so calls never queue behind each
+# other) and reports through a Future; the pool only runs hedges.  The caller waits on both.
+# Hedges are capped at max_hedge_ratio of all calls, so they can't double the spend.
+# The losing call can't be stopped mid-flight; its answer is just ignored.
+class Hedger:
+
+    def __init__(self, percentile=0.95, max_hedge_ratio=0.05, min_samples=20, initial_delay=2.0,
+                 window=500, max_workers=32):
+        self.percentile = percentile
+        self.max_hedge_ratio = min(max_hedge_ratio, 0.5)
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self):
+        # Until there's enough history, wait initial_delay seconds before hedging:
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def _first(self, fn):
+        # Only the first request's latency is recorded; hedges would skew the histogram low.
+        future = Future()
+
+        def run():
+            # Marked running, like a pool's futures, so losing the race can't cancel it under us:
+            future.set_running_or_notify_cancel()
+            start = time.perf_counter()
+            try:
+                result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            with self.lock:
+                self.latencies.append(time.perf_counter() - start)
+            future.set_result(result)
+
+        threading.Thread(target=run, name="hedge-first", daemon=True).start()
+        return future
+
+    def call(self, fn):
+        first = self._first(fn)
+        with self.lock:
+            self.calls += 1
+        done, _ = wait([first], timeout=self.delay())
+        if done:
+            return first.result()
+
+        with self.lock:
+            if self.hedges >= self.max_hedge_ratio * self.calls:
+                hedge = None
+            else:
+                self.hedges += 1
+                hedge = self.pool.submit(fn)
+        if hedge is None:
+            return first.result()
+
+        # First good answer wins; if the first one back failed, wait for the other:
+        pending = {first, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            good = [future for future in done if not future.cancelled() and not future.exception()]
+            if good or not pending:
+                winner = good[0] if good else done.pop()
+                if winner is hedge and good:
+                    with self.lock:
+                        self.hedge_wins += 1
+                for loser in pending:
+                    loser.cancel()
+                return winner.result()
+
+    def metrics(self):
+        delay = self.delay()
+        with self.lock:
+            return {
+                "hedge_delay": round(delay, 3),
+                "hedge_rate": round(self.hedges / self.calls, 4) if self.calls else 0.0,
+                "hedge_wins": self.hedge_wins,
+            }
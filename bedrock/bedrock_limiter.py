@@ -0,0 +1 @@
+bedrock-api/shared/bedrock_limiter.py
\ No newline at end of file
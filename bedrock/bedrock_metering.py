@@ -0,0 +1 @@
+bedrock-api/shared/bedrock_metering.py
\ No newline at end of file
@@ -0,0 +1,83 @@
+import threading, time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+
+from bedrock_limiter import is_throttle
+
+
+# Errors that mean "this region is having a bad time", as opposed to a bad request:
+def is_failover_error(error):
+    if isinstance(error, (ConnectionError, ReadTimeoutError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return is_throttle(error) or status >= 500
+    return False
+
+
+# A bedrock-runtime client per region, with exponentially weighted moving averages (EWMAs)
+# of each region's latency and error rate.  Each call goes to the fastest healthy region
+# (latency is weighed up by the error rate); a region that fails with a 5xx, a throttle or a
+# connection error is skipped for `cooldown` seconds and the call fails over to the next one.
+# Regions with no history yet count as fastest, so each one gets tried early on.
+class RegionPool:
+
+    def __init__(self, regions, clients=None, alpha=0.2, cooldown=30.0, clock=time.monotonic):
+        self.regions = list(regions)
+        self.clients = clients or {
+            region: boto3.client('bedrock-runtime', region_name=region,
+                                 config=Config(retries={'total_max_attempts': 1}))
+            for region in self.regions}
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.latency = {region: None for region in self.regions}
+        self.errors = {region: 0.0 for region in self.regions}
+        self.down_until = {region: 0.0 for region in self.regions}
+
+    def ranked(self):
+        now = self.clock()
+        with self.lock:
+            score = lambda region: (self.latency[region] or 0.0) * (1 + self.errors[region])
+            healthy = [r for r in self.regions if self.down_until[r] <= now]
+            resting = [r for r in self.regions if self.down_until[r] > now]
+            # If everything is resting, try them anyway, the one coming back soonest first:
+            return sorted(healthy, key=score) + sorted(resting, key=self.down_until.get)
+
+    def record(self, region, seconds, failed):
+        with self.lock:
+            self.errors[region] += self.alpha * ((1.0 if failed else 0.0) - self.errors[region])
+            if failed:
+                self.down_until[region] = self.clock() + self.cooldown
+            else:
+                last = self.latency[region]
+                self.latency[region] = seconds if last is None else last + self.alpha * (seconds - last)
+
+    def call(self, fn):
+        # fn(client) makes the actual request with the client for the chosen region
+        error = None
+        for region in self.ranked():
+            start = time.perf_counter()
+            try:
+                result = fn(self.clients[region])
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                self.record(region, time.perf_counter() - start, failed=True)
+                error = e
+                continue
+            self.record(region, time.perf_counter() - start, failed=False)
+            return result
+        raise error
+
+    def metrics(self):
+        now = self.clock()
+        with self.lock:
+            return {region: {
+                "latency": round(self.latency[region], 3) if self.latency[region] is not None else None,
+                "error_rate": round(self.errors[region], 4),
+                "healthy": self.down_until[region] <= now,
+            } for region in self.regions}
@@ -0,0 +1,123 @@
+import json, os, threading, time
+from collections import deque
+
+from bedrock_cache import cache_key
+from bedrock_limiter import call_with_retry
+import bedrock_text_gen
+from bedrock_text_gen import build_body, parse_response, default_prompt, estimate_tokens
+
+
+# Model tiering: rather than sending everything to Titan Text Lite, pick the cheapest, fastest
+# model whose context window fits the prompt plus the requested answer, and only move up a tier
+# when it doesn't fit.  If a latency budget is given, the answer length is capped so the estimated
+# generation time fits the budget.  Every decision is logged (with the latency we actually got),
+# so the tier figures below can be tuned offline.
+
+
+# Each model family needs its own request body and has its own response shape:
+def claude_body(prompt, max_tokens):
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": 0,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt or default_prompt}]}],
+    }
+
+
+def claude_response(response_body):
+    return "".join(part.get("text", "") for part in response_body.get("content", []))
+
+
+# (input tokens, output tokens) from a whole invoke_model response:
+def titan_usage(response_body):
+    results = response_body.get("results") or [{}]
+    return response_body.get("inputTextTokenCount"), results[0].get("tokenCount")
+
+
+def claude_usage(response_body):
+    usage = response_body.get("usage", {})
+    return usage.get("input_tokens"), usage.get("output_tokens")
+
+
+# Fastest first.  first_token is seconds to the first token, tokens_per_second the generation
+# speed after that; both are rough starting figures to be tuned from the decision log.
+tiers = [
+    {"model_id": "amazon.titan-text-lite-v1", "context_tokens": 4096, "max_output_tokens": 4096,
+     "first_token": 0.3, "tokens_per_second": 120, "body": build_body, "parse": parse_response, "usage": titan_usage},
+    {"model_id": "amazon.titan-text-express-v1", "context_tokens": 8192, "max_output_tokens": 8192,
+     "first_token": 0.5, "tokens_per_second": 80, "body": build_body, "parse": parse_response, "usage": titan_usage},
+    {"model_id": "anthropic.claude-3-haiku-20240307-v1:0", "context_tokens": 200_000, "max_output_tokens": 4096,
+     "first_token": 0.6, "tokens_per_second": 100, "body": claude_body, "parse": claude_response, "usage": claude_usage},
+]
+
+decision_log = deque(maxlen=1000)
+log_lock = threading.Lock()
+log_path = os.environ.get('BEDROCK_ROUTER_LOG')     # also append decisions to this JSONL file
+
+
+def choose_model(prompt, response_tokens=512, latency_budget=None):
+    input_tokens = estimate_tokens(prompt or default_prompt)
+    decision = {"input_tokens": input_tokens, "response_tokens": response_tokens, "latency_budget": latency_budget}
+
+    for tier in tiers:
+        if input_tokens + min(response_tokens, tier["max_output_tokens"]) > tier["context_tokens"]:
+            continue
+        max_tokens = min(response_tokens, tier["max_output_tokens"], tier["context_tokens"] - input_tokens)
+        reason = "fits" if max_tokens == response_tokens else "capped to model limits"
+        if latency_budget:
+            affordable = int((latency_budget - tier["first_token"]) * tier["tokens_per_second"])
+            if affordable < max_tokens:
+                max_tokens, reason = max(16, affordable), "capped to latency budget"
+        decision.update(model_id=tier["model_id"], max_tokens=max_tokens, reason=reason,
+                        estimated_seconds=round(tier["first_token"] + max_tokens / tier["tokens_per_second"], 2))
+        return tier, decision
+
+    raise ValueError(f"a prompt of about {input_tokens} tokens doesn't fit any model tier")
+
+
+def log_decision(decision):
+    with log_lock:
+        decision_log.append(decision)
+        if log_path:
+            with open(log_path, "a") as f:
+                f.write(json.dumps(decision) + "\n")
+
+
+def route_bedrock(prompt, response_tokens=512, latency_budget=None, bedrock_client=None, caller=None, route=None):
+
+    # Cached answers are free; anything else is metered against the caller's budget, per model.
+    tier, decision = choose_model(prompt, response_tokens, latency_budget)
+    body = tier["body"](prompt, decision["max_tokens"])
+
+    key = cache_key(tier["model_id"], body)
+    response = bedrock_text_gen.cache.get(key)
+    if response is not None:
+        decision.update(cached=True, seconds=0.0)
+        log_decision(decision)
+        return response
+
+    meter = bedrock_text_gen.meter
+    meter.check_budget(caller)
+
+    def invoke():
+        result = (bedrock_client or bedrock_text_gen.client).invoke_model(
+            contentType="application/json",
+            accept="application/json",
+            modelId=tier["model_id"],
+            body=json.dumps(body))
+        return json.loads(result["body"].read())
+
+    start = time.perf_counter()
+    try:
+        response_body = call_with_retry(invoke, bedrock_text_gen.limiter)
+        response = tier["parse"](response_body)
+    except Exception as e:
+        decision.update(error=type(e).__name__, seconds=round(time.perf_counter() - start, 3))
+        log_decision(decision)
+        raise
+    seconds = time.perf_counter() - start
+    meter.record(caller, route, tier["model_id"], *tier["usage"](response_body), seconds)
+    bedrock_text_gen.cache.put(key, response, seconds)
+    decision.update(cached=False, seconds=round(seconds, 3))
+    log_decision(decision)
+    return response
@@ -0,0 +1,137 @@
+import hashlib, json, re, threading
+from collections import OrderedDict
+
+import boto3
+import numpy as np
+
+
+# Semantic cache: answers a prompt from the cache when an earlier prompt meant nearly the same
+# thing ("top 3 European destinations for extroverts" vs "best three places in Europe for
+# outgoing people"), not just when the text matches exactly.  Prompts are turned into unit
+# vectors by an embedder, and a cached answer is used when the cosine similarity is above
+# the threshold.  Keep one cache per model and generation config, like the exact-match cache.
+
+
+# Production embedder, using Amazon Titan Text Embeddings V2:
+class TitanEmbedder:
+
+    def __init__(self, model_id="amazon.titan-embed-text-v2:0", dimensions=256, client=None):
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.client = client or boto3.client('bedrock-runtime')
+
+    def embed(self, text):
+        response = self.client.invoke_model(
+            modelId=self.model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps({"inputText": text, "dimensions": self.dimensions, "normalize": True}))
+        return np.asarray(json.loads(response["body"].read())["embedding"], dtype=np.float32)
+
+
+# Deterministic local embedder for tests and offline runs: words and character trigrams are
+# hashed into a fixed number of signed buckets.  It only catches near-identical wording.
+class HashingEmbedder:
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = re.findall(r"\w+", text.lower())
+        features = words + [w[i:i + 3] for w in words for i in range(max(1, len(w) - 2))]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+# Vectors live in one preallocated NumPy array, with an LRU order over its rows.
+# While the cache is small (up to exact_below rows) a lookup just compares against every row.
+# A full scan of 100k rows takes milliseconds, though, so rows are also bucketed by random-hyperplane
+# signatures (locality-sensitive hashing), in several independent tables: a lookup only compares
+# against the rows in the query's bucket, and the buckets one bit away, in each table.
+# A match at the threshold (0.92) has a signature bit flipped about 13% of the time, so one table
+# of 12 bits finds only about half of them; eight tables find all but about 0.3%, and closer
+# matches are found more often still (benchmarks/semantic_cache.py measures it).
+class SemanticCache:
+
+    def __init__(self, embedder, threshold=0.92, max_entries=100_000, bits=12, tables=8, exact_below=4096, seed=42):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.vectors = None                 # allocated on first put, once the dimension is known
+        self.answers = [None] * max_entries
+        self.signatures = np.zeros((max_entries, tables), dtype=np.int64)
+        self.order = OrderedDict()          # row -> None, least recently used first
+        self.buckets = [{} for _ in range(tables)]     # per table: signature -> set of rows
+        self.bits = bits
+        self.tables = tables
+        self.exact_below = exact_below
+        self.seed = seed
+        self.planes = None
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, text):
+        return np.asarray(self.embedder.embed(text), dtype=np.float32)
+
+    def _signatures(self, vector):
+        # One signature per table
+        if self.planes is None:
+            rng = np.random.default_rng(self.seed)
+            self.planes = rng.standard_normal((self.tables * self.bits, len(vector))).astype(np.float32)
+        signs = (self.planes @ vector > 0).reshape(self.tables, self.bits)
+        return [int(signature) for signature in signs @ (1 << np.arange(self.bits))]
+
+    def _candidates(self, signatures):
+        rows = set()
+        for buckets, signature in zip(self.buckets, signatures):
+            rows.update(buckets.get(signature, ()))
+            for bit in range(self.bits):
+                rows.update(buckets.get(signature ^ (1 << bit), ()))
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def get(self, vector):
+        signatures = self._signatures(vector)
+        with self.lock:
+            if len(self.order) <= self.exact_below:
+                rows = np.arange(len(self.order))
+            else:
+                rows = self._candidates(signatures)
+            if len(rows):
+                similarities = self.vectors[rows] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    row = int(rows[best])
+                    self.order.move_to_end(row)
+                    self.hits += 1
+                    return self.answers[row]
+            self.misses += 1
+            return None
+
+    def put(self, vector, answer):
+        signatures = self._signatures(vector)
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            if len(self.order) < self.max_entries:
+                row = len(self.order)
+            else:
+                # Reuse the least recently used row:
+                row, _ = self.order.popitem(last=False)
+                for buckets, signature in zip(self.buckets, self.signatures[row]):
+                    buckets[int(signature)].discard(row)
+            self.vectors[row] = vector
+            self.answers[row] = answer
+            self.signatures[row] = signatures
+            for buckets, signature in zip(self.buckets, signatures):
+                buckets.setdefault(signature, set()).add(row)
+            self.order[row] = None
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.order)}
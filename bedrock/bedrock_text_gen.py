@@ -1,37 +1,541 @@
-import boto3, json
+import argparse, asyncio, atexit, boto3, json, os, threading, time, weakref
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from functools import lru_cache
+from botocore.config import Config
 
-client = boto3.client('bedrock-runtime')
+from bedrock_cache import ResponseCache, SqliteStore, DynamoDbStore, SingleFlight, AsyncSingleFlight, cache_key
+from bedrock_limiter import AdaptiveLimiter, call_with_retry
+from bedrock_hedge import Hedger
+from bedrock_regions import RegionPool
+from bedrock_metering import Meter, FileSink, EmfSink, BudgetExceeded, caller_from_event
+
+# botocore's own retries are turned off; call_with_retry backs off with jitter instead
+no_retries = Config(retries={'total_max_attempts': 1})
+client = boto3.client('bedrock-runtime', config=no_retries)
 modelId="amazon.titan-text-lite-v1"
+default_prompt = "What are the top 3 recommended European vacation destinations for extroverts?"
+
+
+# Answers are cached in memory; set BEDROCK_CACHE_SQLITE (a file path) or
+# BEDROCK_CACHE_TABLE (a DynamoDB table name) to also keep them across cold starts.
+def make_cache():
+    store = None
+    if os.environ.get('BEDROCK_CACHE_SQLITE'):
+        store = SqliteStore(os.environ['BEDROCK_CACHE_SQLITE'])
+    elif os.environ.get('BEDROCK_CACHE_TABLE'):
+        store = DynamoDbStore(os.environ['BEDROCK_CACHE_TABLE'], os.environ.get('BEDROCK_CACHE_ENDPOINT'))
+    return ResponseCache(
+        max_entries=int(os.environ.get('BEDROCK_CACHE_SIZE', '1024')),
+        ttl_seconds=float(os.environ.get('BEDROCK_CACHE_TTL', '3600')),
+        store=store)
+
+cache = make_cache()
+
+# Optional semantic cache (needs numpy), which also answers prompts that are worded differently
+# but mean the same thing.  BEDROCK_SEMANTIC_CACHE_THRESHOLD (e.g. 0.92) is the cosine similarity
+# a cached prompt needs to count as a match; prompts are embedded with Titan Text Embeddings.
+semantic_cache = None
+if os.environ.get('BEDROCK_SEMANTIC_CACHE_THRESHOLD'):
+    from bedrock_semantic_cache import SemanticCache, TitanEmbedder
+    semantic_cache = SemanticCache(
+        TitanEmbedder(client=client),
+        threshold=float(os.environ['BEDROCK_SEMANTIC_CACHE_THRESHOLD']),
+        max_entries=int(os.environ.get('BEDROCK_SEMANTIC_CACHE_SIZE', '100000')))
+
+# Optionally spread each model over several regions and fail over between them, e.g.
+# BEDROCK_MODEL_REGIONS='{"amazon.titan-text-lite-v1": ["us-east-1", "us-west-2"]}'
+region_pools = {
+    model: RegionPool(regions)
+    for model, regions in json.loads(os.environ.get('BEDROCK_MODEL_REGIONS', '{}')).items()}
+
+# Opt-in hedging: set BEDROCK_HEDGE_PERCENTILE (e.g. 0.95) to re-send calls that are slower
+# than that percentile of recent calls, for at most BEDROCK_HEDGE_MAX_RATIO of all calls.
+hedger = None
+if os.environ.get('BEDROCK_HEDGE_PERCENTILE'):
+    hedger = Hedger(
+        percentile=float(os.environ['BEDROCK_HEDGE_PERCENTILE']),
+        max_hedge_ratio=float(os.environ.get('BEDROCK_HEDGE_MAX_RATIO', '0.05')))
 
-def call_bedrock(prompt):
+# Identical prompts that arrive while the first one is still being answered wait for that answer:
+inflight = SingleFlight()
+
+# Calls are paced to BEDROCK_REQUESTS_PER_SECOND (0 = no rate cap, just adaptive concurrency):
+limiter = AdaptiveLimiter(
+    rate=float(os.environ.get('BEDROCK_REQUESTS_PER_SECOND', '0')),
+    max_limit=int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '64')))
+
+# Token usage per caller and route is flushed every BEDROCK_METER_FLUSH_SECONDS to
+# BEDROCK_METER_FILE (JSONL), or as EMF log lines with BEDROCK_METER_EMF=1.  Per-caller token
+# budgets per BEDROCK_BUDGET_WINDOW seconds, e.g. BEDROCK_TOKEN_BUDGETS='{"acme": 200000, "*": 50000}'
+def make_meter():
+    sink = None
+    if os.environ.get('BEDROCK_METER_FILE'):
+        sink = FileSink(os.environ['BEDROCK_METER_FILE'])
+    elif os.environ.get('BEDROCK_METER_EMF'):
+        sink = EmfSink()
+    return Meter(
+        sink=sink,
+        flush_seconds=float(os.environ.get('BEDROCK_METER_FLUSH_SECONDS', '60')),
+        budgets=json.loads(os.environ.get('BEDROCK_TOKEN_BUDGETS', '{}')),
+        budget_window=float(os.environ.get('BEDROCK_BUDGET_WINDOW', '86400')))
+
+meter = make_meter()
+atexit.register(meter.flush)
+
+
+def build_body(prompt, max_tokens=512):
 
     # if the prompt is empty, set it to a default value
     if not prompt:
-        prompt = "What are the top 3 recommended European vacation destinations for extroverts?"
+        prompt = default_prompt
 
     # Note that the input for the body depends on the selected model
     # This body works for Amazon Titan:
-    body = {
+    return {
         "inputText": f"{prompt}",
         "textGenerationConfig":
-        {"temperature": 0, "topP": 0.9, "maxTokenCount": 512, "stopSequences": [] }
+        {"temperature": 0, "topP": 0.9, "maxTokenCount": max_tokens, "stopSequences": [] }
         }
 
-    # There is also a streaming option
-    response = client.invoke_model(
+
+def request_args(prompt, model_id=None, max_tokens=512):
+    return dict(
         contentType="application/json",
         accept="*/*",
-        modelId=modelId,
-        body=json.dumps(body)  
+        modelId=model_id or modelId,
+        body=json.dumps(build_body(prompt, max_tokens))
     )
 
-    return json.loads(response.get('body').read()).get('results')[0].get('outputText')
+
+def chunk_data(event):
+
+    # Each stream event carries a JSON chunk; for Titan the new text is in "outputText",
+    # and the first and last chunks also carry the input and output token counts.
+    chunk = event.get('chunk')
+    return json.loads(chunk.get('bytes')) if chunk else {}
+
+
+def chunk_text(event):
+    return chunk_data(event).get('outputText')
+
+
+def parse_response(response_body):
+
+    # The whole (non-streaming) Titan response has the answer in results[0].outputText:
+    return response_body.get('results')[0].get('outputText')
+
+
+def stream_bedrock(prompt, bedrock_client=None, usage=None, model_id=None, max_tokens=512):
+
+    # The streaming option hands back the answer a few tokens at a time,
+    # so the caller sees the first words long before the model is finished:
+    response = (bedrock_client or client).invoke_model_with_response_stream(**request_args(prompt, model_id, max_tokens))
+
+    # Errors from the model show up while iterating, as botocore EventStreamErrors.
+    # Pass a dict as usage to get the token counts filled in.
+    for event in response.get('body'):
+        data = chunk_data(event)
+        if usage is not None:
+            if data.get('inputTextTokenCount') is not None:
+                usage['input_tokens'] = data['inputTextTokenCount']
+            if data.get('totalOutputTextTokenCount') is not None:
+                usage['output_tokens'] = data['totalOutputTextTokenCount']
+        text = data.get('outputText')
+        if text:
+            yield text
+
+
+def generate(prompt, bedrock_client=None, usage=None):
+
+    # One whole answer, from the given client, or else from the fastest healthy region:
+    pool = region_pools.get(modelId)
+    if bedrock_client or not pool:
+        return "".join(stream_bedrock(prompt, bedrock_client, usage))
+    return pool.call(lambda region_client: "".join(stream_bedrock(prompt, region_client, usage)))
+
+
+def call_bedrock(prompt, bedrock_client=None, caller=None, route=None):
+
+    # temperature is 0, so a repeated request can be answered from the cache:
+    body = build_body(prompt)
+    key = cache_key(modelId, body)
+    response = cache.get(key)
+    if response is not None:
+        return response
+
+    # Exact cache hits are free; past here we call Bedrock (for the embedding, at least),
+    # so a caller that has used up its token budget stops here:
+    meter.check_budget(caller)
+
+    # ...or, if it's turned on, by the answer to a prompt that means the same thing:
+    vector = None
+    if semantic_cache:
+        vector = call_with_retry(lambda: semantic_cache.embed(body["inputText"]), limiter)
+        response = semantic_cache.get(vector)
+        if response is not None:
+            return response
+
+    # Same contract as before (prompt in, whole answer out), just built on the stream.
+    # Only answers go in the cache; an error is passed to whoever was waiting and then forgotten.
+    def invoke():
+        start = time.perf_counter()
+        usage = {}
+        call = lambda: call_with_retry(lambda: generate(prompt, bedrock_client, usage), limiter)
+        response = hedger.call(call) if hedger else call()
+        latency = time.perf_counter() - start
+        meter.record(caller, route, modelId, usage.get('input_tokens'), usage.get('output_tokens'), latency)
+        cache.put(key, response, latency)
+        if vector is not None:
+            semantic_cache.put(vector, response)
+        return response
+
+    return inflight.do(key, invoke)
+
+
+# One client per pool size, with enough HTTP connections for every worker thread
+# (botocore clients are thread safe, but only keep 10 connections by default):
+@lru_cache(maxsize=None)
+def pooled_client(max_concurrency):
+    return boto3.client('bedrock-runtime', config=no_retries.merge(Config(max_pool_connections=max_concurrency)))
+
+
+def call_bedrock_many(prompts, max_concurrency=8, bedrock_client=None):
+
+    # Runs up to max_concurrency prompts at once and returns the answers in the same order
+    # as the prompts.  A prompt that fails gets its exception in its slot instead of an answer,
+    # so one bad prompt doesn't throw away the rest of the batch.
+
+    # With region failover on, the region pool's own clients are used instead of a pooled one:
+    if bedrock_client is None and modelId not in region_pools:
+        bedrock_client = pooled_client(max_concurrency)
+
+    def answer(prompt):
+        try:
+            return call_bedrock(prompt, bedrock_client)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        return list(pool.map(answer, prompts))
+
+
+
+# Converse API path with prompt caching.  When every prompt starts with the same long instructions,
+# models that support prompt caching can keep that prefix processed between calls: a cachePoint
+# after the system prefix marks it, and later calls read it from the cache (cheaper and faster)
+# instead of processing it again.  The prefix needs to be long enough to be cached (for Claude,
+# about 1,024 tokens); shorter ones are simply processed as usual.
+# Titan text models don't support caching, so for them the prefix is just put in front of the
+# prompt and sent with invoke_model, to the model and with the max_tokens the caller asked for.
+cache_capable_models = ("anthropic.claude-3-5-haiku", "anthropic.claude-3-7-sonnet", "anthropic.claude-sonnet-4",
+                        "anthropic.claude-opus-4", "amazon.nova-micro", "amazon.nova-lite", "amazon.nova-pro")
+converse_usage = {"calls": 0, "input_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0, "output_tokens": 0}
+converse_lock = threading.Lock()
+
+
+def converse_bedrock(prompt, system_prefix, model_id=None, max_tokens=512, bedrock_client=None, caller=None, route=None):
+
+    # Returns {"text": ..., "api": "converse" or "invoke_model", "usage": {...}}, where usage splits
+    # the input tokens into uncached ("input_tokens"), read from the cache, and written to it.
+    # Like call_bedrock, the call is metered for the caller and refused once its budget is used up.
+    model_id = model_id or modelId
+    meter.check_budget(caller)
+    start = time.perf_counter()
+    if model_id.startswith("amazon.titan"):
+        usage = {"input_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0, "output_tokens": 0}
+        text = call_with_retry(lambda: "".join(stream_bedrock(f"{system_prefix}\n\n{prompt or default_prompt}",
+                                                              bedrock_client, usage, model_id, max_tokens)), limiter)
+        meter.record(caller, route, model_id, usage["input_tokens"], usage["output_tokens"], time.perf_counter() - start)
+        return {"text": text, "api": "invoke_model", "usage": usage}
+
+    system = [{"text": system_prefix}]
+    if any(name in model_id for name in cache_capable_models):
+        system.append({"cachePoint": {"type": "default"}})
+
+    response = call_with_retry(lambda: (bedrock_client or client).converse(
+        modelId=model_id,
+        system=system,
+        messages=[{"role": "user", "content": [{"text": prompt or default_prompt}]}],
+        inferenceConfig={"maxTokens": max_tokens, "temperature": 0, "topP": 0.9},
+    ), limiter)
+
+    usage = response.get("usage", {})
+    usage = {
+        "input_tokens": usage.get("inputTokens", 0),
+        "cache_read_tokens": usage.get("cacheReadInputTokens", 0),
+        "cache_write_tokens": usage.get("cacheWriteInputTokens", 0),
+        "output_tokens": usage.get("outputTokens", 0),
+    }
+    meter.record(caller, route, model_id, usage["input_tokens"], usage["output_tokens"], time.perf_counter() - start,
+                 usage["cache_read_tokens"], usage["cache_write_tokens"])
+    with converse_lock:
+        converse_usage["calls"] += 1
+        for name, count in usage.items():
+            converse_usage[name] += count
+
+    text = "".join(part.get("text", "") for part in response["output"]["message"]["content"])
+    return {"text": text, "api": "converse", "usage": usage}
+
+
+# Bulk offline mode: reads prompts from a JSONL file (one {"prompt": ..., "id": ...} per line),
+# answers up to max_concurrency at once, and appends {"offset", "id", "prompt", "response"}
+# (or "error") to the output JSONL as each one finishes.  Lines are identified by their byte
+# offset in the input file.  A small checkpoint file records how far we've got: every line
+# before "watermark" is done, plus the few lines after it that finished early ("done").
+# A rerun picks up from the checkpoint.  A crash between writing a result and writing the
+# checkpoint can repeat that one line, so dedupe the output on "offset" if that matters.
+# Prompts that fail are written out with their error and are not retried by a rerun.
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"watermark": 0, "done": []}
+
+
+def save_checkpoint(path, watermark, done):
+    with open(path + ".tmp", "w") as f:
+        json.dump({"watermark": watermark, "done": sorted(done)}, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_bulk(input_path, output_path, max_concurrency=8, checkpoint_path=None, bedrock_client=None):
+    checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+    checkpoint = load_checkpoint(checkpoint_path)
+    done = {offset for offset in checkpoint["done"] if offset >= checkpoint["watermark"]}
+    running = {}                            # future -> input offset
+    max_done_ahead = max_concurrency * 64   # stop reading ahead if one line is holding things up
+    summary = {"answered": 0, "failed": 0, "skipped": 0}
+
+    if bedrock_client is None and modelId not in region_pools:
+        bedrock_client = pooled_client(max_concurrency)
+
+    def answer(line):
+        record = json.loads(line)
+        return record.get("id"), record.get("prompt"), call_bedrock(record.get("prompt"), bedrock_client)
+
+    with open(input_path, "rb") as source, open(output_path, "a") as output, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        source.seek(checkpoint["watermark"])
+
+        def finish(futures):
+            for future in futures:
+                offset = running.pop(future)
+                try:
+                    record_id, prompt, response = future.result()
+                    result = {"offset": offset, "id": record_id, "prompt": prompt, "response": response}
+                    summary["answered"] += 1
+                except Exception as e:
+                    result = {"offset": offset, "error": f"{type(e).__name__}: {e}"}
+                    summary["failed"] += 1
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                done.add(offset)
+            save()
+
+        def save():
+            # Everything before the oldest line still running (or before the next unread line) is done:
+            watermark = min(running.values(), default=source.tell())
+            done.difference_update({offset for offset in done if offset < watermark})
+            save_checkpoint(checkpoint_path, watermark, done)
+
+        while True:
+            offset = source.tell()
+            line = source.readline()
+            if not line:
+                break
+            if offset in done or not line.strip():
+                summary["skipped"] += offset in done
+                continue
+            running[pool.submit(answer, line)] = offset
+            while len(running) >= max_concurrency or (running and len(done) >= max_done_ahead):
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                finish(finished)
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            finish(finished)
+        save()
+
+    return summary
+
+
+# Long inputs: Titan Text Lite only takes about 4K tokens, so bigger documents are split into
+# overlapping chunks, each chunk is answered on its own (map, several at a time), and the partial
+# answers are then combined (reduce).  Token counts are estimated at ~4 characters per token.
+chars_per_token = 4
+
+def estimate_tokens(text):
+    return max(1, len(text) // chars_per_token)
+
+
+def split_into_chunks(text, chunk_tokens=3000, overlap_tokens=200):
+
+    # text can be a string or any iterable of strings (like an open file), and the chunks are
+    # produced lazily, so only about one chunk of the input is held here at a time.
+    # Chunks end at whitespace where possible, and each one repeats the end of the previous one.
+    size = chunk_tokens * chars_per_token
+    overlap = overlap_tokens * chars_per_token
+    buffer = ""
+    for piece in ([text] if isinstance(text, str) else text):
+        buffer += piece
+        while len(buffer) > size:
+            cut = buffer.rfind(" ", overlap + 1, size)
+            cut = cut if cut > 0 else size
+            yield buffer[:cut]
+            buffer = buffer[max(0, cut - overlap):]
+    if buffer.strip():
+        yield buffer
+
+
+def map_reduce_bedrock(text, instruction="Summarize the following text.",
+                       reduce_instruction="Combine these partial answers into a single answer.",
+                       max_concurrency=4, chunk_tokens=3000, overlap_tokens=200):
+
+    # A generator: yields {"chunk": i, "output": ...} as each chunk is answered (in the order they
+    # finish), then a final {"result": ..., ...} with the combined answer and timing stats.
+    # At most max_concurrency chunks are read ahead and in flight at any time.
+    def answer(i, chunk):
+        start = time.perf_counter()
+        output = call_bedrock(f"{instruction}\n\n{chunk}")
+        return i, output, time.perf_counter() - start
+
+    partials, latencies = {}, []
+
+    def finished(futures):
+        for future in futures:
+            i, output, seconds = future.result()
+            partials[i] = output
+            latencies.append(seconds)
+            yield {"chunk": i, "output": output}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        pending = set()
+        for i, chunk in enumerate(split_into_chunks(text, chunk_tokens, overlap_tokens)):
+            pending.add(pool.submit(answer, i, chunk))
+            if len(pending) >= max_concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+        yield from finished(as_completed(pending))
+        map_seconds = time.perf_counter() - start
+
+        # Reduce in rounds, combining as many partial answers per call as fit in a chunk (with the
+        # instruction).  Every call takes at least two answers, even if they don't fit, so each
+        # round has fewer answers than the one before and the loop always ends.
+        answers = [partials[i] for i in sorted(partials)]
+        while len(answers) > 1:
+            batches, batch = [], []
+            for output in answers:
+                prompt = f"{reduce_instruction}\n\n" + "\n\n".join(batch + [output])
+                if len(batch) >= 2 and estimate_tokens(prompt) > chunk_tokens:
+                    batches.append(batch)
+                    batch = []
+                batch.append(output)
+            batches.append(batch)
+            # An answer left on its own goes through to the next round as it is:
+            combine = [b for b in batches if len(b) > 1]
+            answers = list(pool.map(call_bedrock, [f"{reduce_instruction}\n\n" + "\n\n".join(b) for b in combine]))
+            answers += [b[0] for b in batches if len(b) == 1]
+
+    sequential_seconds = sum(latencies)
+    yield {
+        "result": answers[0] if answers else "",
+        "chunks": len(partials),
+        "map_seconds": round(map_seconds, 3),
+        "sequential_seconds": round(sequential_seconds, 3),
+        "saved_seconds": round(sequential_seconds - map_seconds, 3),
+    }
+
+
+def call_bedrock_long(text, instruction="Summarize the following text.", max_concurrency=4):
+    for event in map_reduce_bedrock(text, instruction, max_concurrency=max_concurrency):
+        if "result" in event:
+            return event["result"]
+
+
+# asyncio versions of the calls above, for use inside an event loop.  They use aiobotocore
+# (pip install aiobotocore), so waiting on the model doesn't tie up any threads at all,
+# and a semaphore caps how many calls are in flight at once.
+# The async path skips the response cache, because its persistent tiers do blocking I/O.
+# The semaphore, the client and the in-flight tasks only work on the event loop that made them, so
+# each running loop gets its own (a script that calls asyncio.run twice has two loops); call
+# close_async_client before a loop finishes to close its client's connections.
+async_concurrency = int(os.environ.get('BEDROCK_ASYNC_CONCURRENCY', '16'))
+async_loops = weakref.WeakKeyDictionary()     # event loop -> {"limit": ..., "lock": ..., "client": ..., "inflight": ...}
+
+def async_state():
+    loop = asyncio.get_running_loop()
+    state = async_loops.get(loop)
+    if state is None:
+        state = async_loops[loop] = {"limit": asyncio.Semaphore(async_concurrency), "lock": asyncio.Lock(), "client": None,
+                                     "inflight": AsyncSingleFlight()}
+    return state
+
+
+async def get_async_client():
+    state = async_state()
+    async with state["lock"]:
+        if state["client"] is None:
+            from aiobotocore.session import get_session
+            state["client"] = await get_session().create_client('bedrock-runtime').__aenter__()
+    return state["client"]
+
+
+async def close_async_client():
+    state = async_loops.pop(asyncio.get_running_loop(), None)
+    if state and state["client"] is not None:
+        await state["client"].close()
+
+
+async def stream_bedrock_async(prompt, bedrock_client=None, usage=None):
+
+    # The semaphore is held until the stream is finished, since that's when the call is done.
+    # Pass a dict as usage to get the token counts filled in, as with stream_bedrock.
+    async with async_state()["limit"]:
+        bedrock_client = bedrock_client or await get_async_client()
+        response = await bedrock_client.invoke_model_with_response_stream(**request_args(prompt))
+        async for event in response.get('body'):
+            data = chunk_data(event)
+            if usage is not None:
+                if data.get('inputTextTokenCount') is not None:
+                    usage['input_tokens'] = data['inputTextTokenCount']
+                if data.get('totalOutputTextTokenCount') is not None:
+                    usage['output_tokens'] = data['totalOutputTextTokenCount']
+            text = data.get('outputText')
+            if text:
+                yield text
+
+
+async def call_bedrock_async(prompt, bedrock_client=None, caller=None, route=None):
+
+    meter.check_budget(caller)
+
+    async def invoke():
+        start = time.perf_counter()
+        usage = {}
+        response = "".join([text async for text in stream_bedrock_async(prompt, bedrock_client, usage)])
+        meter.record(caller, route, modelId, usage.get('input_tokens'), usage.get('output_tokens'),
+                     time.perf_counter() - start)
+        return response
+
+    return await async_state()["inflight"].do(cache_key(modelId, build_body(prompt)), invoke)
 
 
 
 if __name__ == "__main__":
-    result = call_bedrock("When is the next planetary conjunction involving at least three planets?")
-    print(result)
+    # With no arguments, just answer a sample prompt.  For bulk runs:
+    #   python bedrock_text_gen.py --input prompts.jsonl --output results.jsonl --concurrency 8
+    parser = argparse.ArgumentParser(description="Generate text with Amazon Bedrock")
+    parser.add_argument("--input", help="JSONL file of prompts, one {\"prompt\": ...} per line")
+    parser.add_argument("--output", help="JSONL file the results are appended to")
+    parser.add_argument("--concurrency", type=int, default=8, help="prompts to run at once")
+    args = parser.parse_args()
+
+    if args.input:
+        print(run_bulk(args.input, args.output or args.input + ".results.jsonl", args.concurrency))
+    else:
+        for text in stream_bedrock("When is the next planetary conjunction involving at least three planets?"):
+            print(text, end="", flush=True)
+        print()
 
 
 
@@ -40,13 +544,36 @@ def lambda_handler(event, context):
 
     # extract a query parameter called "prompt" from the input event:
     prompt = event['queryStringParameters']['prompt']
-    
-    response = call_bedrock(prompt)
+
+    # Usage is metered per tenant and per API route:
+    caller = caller_from_event(event)
+    route = event.get('resource')
+
+    # An exact-cache miss can still be a semantic-cache hit, so look at what each cache answered:
+    exact_hits = cache.hits + cache.store_hits
+    semantic_hits = semantic_cache.hits if semantic_cache else 0
+    try:
+        response = call_bedrock(prompt, caller=caller, route=route)
+    except BudgetExceeded as e:
+        return {"statusCode": 429, "body": json.dumps({"error": str(e)})}
+
+    headers = {"X-Cache": "MISS"}
+    if cache.hits + cache.store_hits > exact_hits:
+        headers = {"X-Cache": "HIT", "X-Cache-Match": "exact"}
+    elif semantic_cache and semantic_cache.hits > semantic_hits:
+        headers = {"X-Cache": "HIT", "X-Cache-Match": "semantic"}
 
     return {
         "statusCode": 200,
+        "headers": headers,
         "body": json.dumps({
             "prompt": prompt,
             "response": response,
+            "cache": cache.stats(),
+            "limiter": limiter.metrics(),
+            "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+            "hedging": hedger.metrics() if hedger else None,
+            "regions": region_pools[modelId].metrics() if modelId in region_pools else None,
+            "tokens_used": meter.used(caller or "anonymous"),
         }),
     }
@@ -0,0 +1,48 @@
+# Times SemanticCache lookups with a full cache (100k entries by default), using random
+# unit vectors so no embedding model is needed, and measures recall: how many queries that
+# are within the threshold of a cached vector actually find it, at a few similarities from
+# just over the cache's threshold up.
+#   python benchmarks/semantic_cache.py [entries] [dimensions]
+import os, sys, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bedrock_semantic_cache import SemanticCache
+
+entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+dimensions = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+rng = np.random.default_rng(0)
+vectors = rng.standard_normal((entries, dimensions)).astype(np.float32)
+vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+cache = SemanticCache(embedder=None, max_entries=entries)
+start = time.perf_counter()
+for i, vector in enumerate(vectors):
+    cache.put(vector, i)
+print(f"filled {entries} entries of {dimensions} dims in {time.perf_counter() - start:.1f}s")
+
+
+# A query at exactly the given cosine similarity to a cached vector: v*cos + (unit vector orthogonal to v)*sin
+def near(vector, similarity):
+    noise = rng.standard_normal(dimensions).astype(np.float32)
+    noise -= (noise @ vector) * vector
+    noise /= np.linalg.norm(noise)
+    return (similarity * vector + np.sqrt(1 - similarity ** 2) * noise).astype(np.float32)
+
+
+timings = []
+for similarity in (cache.threshold + 0.002, 0.95, 0.99):
+    found = 0
+    rows = range(0, entries, max(1, entries // 2000))
+    for row in rows:
+        query = near(vectors[row], similarity)
+        start = time.perf_counter()
+        found += cache.get(query) == row
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"recall at cosine {similarity:.3f} (threshold {cache.threshold}): {found / len(rows):.2%}")
+
+timings.sort()
+pick = lambda p: timings[min(len(timings) - 1, int(p * len(timings)))]
+print(f"lookups: p50={pick(0.5):.3f}ms p99={pick(0.99):.3f}ms")
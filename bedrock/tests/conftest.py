@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+# bedrock_text_gen creates its client at import time, which needs a region even when
+# the tests swap in a fake client:
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+# Tests that use the real client (test_call_bedrock) need AWS credentials and Bedrock access.
+# With BEDROCK_EMULATOR=1 they talk to the local emulator instead, so the suite runs offline.
+@pytest.fixture(autouse=True, scope="session")
+def bedrock_emulator():
+    if os.environ.get("BEDROCK_EMULATOR") != "1":
+        yield None
+        return
+
+    import boto3
+    from botocore.config import Config
+    import bedrock_text_gen
+    from bedrock_emulator import EmulatorSettings, start_emulator
+
+    server = start_emulator(settings=EmulatorSettings(
+        latency_median=0, chunk_delay=0, answers={"natural satellite": "It is called the moon."}))
+    original = bedrock_text_gen.client
+    bedrock_text_gen.client = boto3.client(
+        "bedrock-runtime", endpoint_url=server.url, aws_access_key_id="emulator", aws_secret_access_key="emulator",
+        config=Config(retries={"total_max_attempts": 1}))
+    yield server
+    bedrock_text_gen.client = original
+    server.shutdown()
@@ -1,4 +1,63 @@
-from bedrock_text_gen import call_bedrock
+import asyncio, base64, io, json, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+
+import bedrock_text_gen
+from bedrock_text_gen import call_bedrock, call_bedrock_async, call_bedrock_many, stream_bedrock, stream_bedrock_async
+from bedrock_text_gen import map_reduce_bedrock, split_into_chunks, run_bulk, converse_bedrock
+from bedrock_cache import ResponseCache, SingleFlight, SqliteStore
+from bedrock_limiter import AdaptiveLimiter, call_with_retry
+from bedrock_hedge import Hedger
+from bedrock_regions import RegionPool
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from bedrock_batch import call_bedrock_batch
+import bedrock_router
+from bedrock_router import choose_model, route_bedrock
+from bedrock_emulator import EmulatorSettings, start_emulator
+from bedrock_metering import Meter, FileSink, EmfSink, BudgetExceeded
+from botocore.config import Config
+
+
+# Stands in for the bedrock-runtime client, answering every prompt with canned text:
+class FakeClient:
+    def __init__(self, answer="The Moon.", chunk_size=4):
+        self.answer = answer
+        self.chunk_size = chunk_size
+        self.bodies = []
+
+    def answer_for(self, prompt):
+        return self.answer
+
+    def invoke_model(self, **kwargs):
+        body = json.loads(kwargs["body"])
+        self.bodies.append(body)
+        answer = self.answer_for(body["inputText"])
+        result = {"results": [{"outputText": answer, "tokenCount": len(answer.split())}]}
+        return {"body": io.BytesIO(json.dumps(result).encode())}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        body = json.loads(kwargs["body"])
+        self.bodies.append(body)
+        answer = self.answer_for(body["inputText"])
+        pieces = [answer[i:i + self.chunk_size] for i in range(0, len(answer), self.chunk_size)]
+        chunks = [{"outputText": p} for p in pieces]
+        # Like Titan, the first chunk has the input token count and the last one the output count:
+        chunks[0]["inputTextTokenCount"] = len(body["inputText"].split())
+        chunks[-1]["totalOutputTextTokenCount"] = len(answer.split())
+        return {"body": iter({"chunk": {"bytes": json.dumps(c).encode()}} for c in chunks)}
+
+
+@pytest.fixture()
+def fake_client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(bedrock_text_gen, "client", fake)
+    monkeypatch.setattr(bedrock_text_gen, "cache", ResponseCache())
+    monkeypatch.setattr(bedrock_text_gen, "inflight", SingleFlight())
+    return fake
+
 
 # make test method:
 def test_call_bedrock():
@@ -9,3 +68,765 @@ def test_call_bedrock():
     assert isinstance(response, str)
     assert "moon" in response
 
+
+def test_stream_bedrock_yields_chunks(fake_client):
+    chunks = list(stream_bedrock("What is the earth's natural satellite called?"))
+
+    assert chunks == ["The ", "Moon", "."]
+    assert fake_client.bodies[0]["inputText"] == "What is the earth's natural satellite called?"
+
+
+def test_call_bedrock_joins_stream(fake_client):
+    assert call_bedrock("") == "The Moon."
+    assert fake_client.bodies[0]["inputText"] == bedrock_text_gen.default_prompt
+
+
+def test_call_bedrock_answers_repeats_from_cache(fake_client):
+    assert call_bedrock("Name  the moon") == "The Moon."
+    assert call_bedrock(" Name the moon ") == "The Moon."
+
+    assert len(fake_client.bodies) == 1
+    assert bedrock_text_gen.cache.stats()["hits"] == 1
+    assert bedrock_text_gen.cache.stats()["misses"] == 1
+
+
+def test_cache_evicts_least_recently_used_and_expired():
+    now = [1000.0]
+    cache = ResponseCache(max_entries=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    now[0] += 11
+    assert cache.get("c") is None
+
+
+def test_sqlite_store_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(store=SqliteStore(path)).put("key", "text", latency=2.5)
+
+    cache = ResponseCache(store=SqliteStore(path))
+    assert cache.get("key") == "text"
+    assert cache.stats()["store_hits"] == 1
+    assert cache.stats()["saved_seconds"] == 2.5
+
+
+def test_call_bedrock_many_keeps_order_and_isolates_errors(fake_client):
+    class FlakyClient(FakeClient):
+        def answer_for(self, prompt):
+            if prompt == "bad":
+                raise RuntimeError("boom")
+            return prompt.upper()
+
+    results = call_bedrock_many(["one", "bad", "three"], max_concurrency=2, bedrock_client=FlakyClient())
+
+    assert results[0] == "ONE"
+    assert isinstance(results[1], RuntimeError)
+    assert results[2] == "THREE"
+
+
+# The same canned answers, but through an aiobotocore-style async client:
+class FakeAsyncClient(FakeClient):
+    async def invoke_model_with_response_stream(self, **kwargs):
+        events = super().invoke_model_with_response_stream(**kwargs)["body"]
+
+        async def body():
+            for event in events:
+                await asyncio.sleep(0)
+                yield event
+        return {"body": body()}
+
+
+def test_stream_bedrock_async_yields_chunks():
+    async def collect():
+        return [text async for text in stream_bedrock_async("moon?", FakeAsyncClient())]
+
+    assert asyncio.run(collect()) == ["The ", "Moon", "."]
+
+
+def test_call_bedrock_async_answers_each_prompt():
+    fake = FakeAsyncClient()
+
+    async def ask_all():
+        return await asyncio.gather(*[call_bedrock_async(f"moon {i}?", fake) for i in range(5)])
+
+    assert asyncio.run(ask_all()) == ["The Moon."] * 5
+    assert len(fake.bodies) == 5
+
+
+def test_async_calls_are_limited_on_every_event_loop(monkeypatch):
+    class SlowAsyncClient(FakeAsyncClient):
+        running = most = 0
+        closed = False
+
+        async def invoke_model_with_response_stream(self, **kwargs):
+            self.running += 1
+            self.most = max(self.most, self.running)
+            await asyncio.sleep(0.01)
+            self.running -= 1
+            return await super().invoke_model_with_response_stream(**kwargs)
+
+        async def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(bedrock_text_gen, "async_concurrency", 2)
+
+    async def ask_all(fake, run):
+        bedrock_text_gen.async_state()["client"] = fake
+        answers = await asyncio.gather(*[call_bedrock_async(f"moon {run} {i}?") for i in range(6)])
+        await bedrock_text_gen.close_async_client()
+        return answers
+
+    # A second asyncio.run is a new event loop; the first loop's semaphore would refuse to work there:
+    for run in range(2):
+        fake = SlowAsyncClient()
+        assert asyncio.run(ask_all(fake, run)) == ["The Moon."] * 6
+        assert fake.most == 2 and fake.closed
+    assert len(bedrock_text_gen.async_loops) == 0
+
+
+def throttled():
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+
+
+def test_limiter_halves_on_throttle_and_grows_on_success():
+    limiter = AdaptiveLimiter(initial_limit=8)
+
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.metrics()["concurrency_limit"] == 4
+
+    for _ in range(8):
+        limiter.acquire()
+        limiter.release()
+    assert 5 < limiter.metrics()["concurrency_limit"] < 7
+    assert limiter.metrics()["throttle_rate"] == round(1 / 9, 4)
+
+
+def test_call_with_retry_backs_off_on_throttling_only():
+    attempts, waits = [], []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise throttled()
+        return "ok"
+
+    assert call_with_retry(flaky, AdaptiveLimiter(), sleep=waits.append) == "ok"
+    assert len(waits) == 2 and all(0 <= w <= 0.5 for w in waits)
+
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        call_with_retry(broken, AdaptiveLimiter(), sleep=waits.append)
+    assert len(waits) == 2
+
+
+def test_concurrent_identical_prompts_share_one_call(fake_client):
+    class SlowClient(FakeClient):
+        def answer_for(self, prompt):
+            time.sleep(0.2)
+            return "The Moon."
+
+    slow = SlowClient()
+    assert call_bedrock_many(["moon?"] * 5, max_concurrency=5, bedrock_client=slow) == ["The Moon."] * 5
+    assert len(slow.bodies) == 1
+    assert bedrock_text_gen.inflight.shared >= 1
+
+
+def test_errors_are_shared_but_never_cached(fake_client):
+    class DownClient(FakeClient):
+        def answer_for(self, prompt):
+            raise RuntimeError("model unavailable")
+
+    down = DownClient()
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            call_bedrock("moon?", down)
+    assert len(down.bodies) == 2
+    assert call_bedrock("moon?") == "The Moon."
+
+
+def test_concurrent_async_prompts_share_one_call():
+    fake = FakeAsyncClient()
+
+    async def ask_all():
+        return await asyncio.gather(*[call_bedrock_async("same moon?", fake) for _ in range(5)])
+
+    assert asyncio.run(ask_all()) == ["The Moon."] * 5
+    assert len(fake.bodies) == 1
+
+
+def test_event_loops_on_other_threads_do_not_share_in_flight_calls():
+    class SlowAsyncClient(FakeAsyncClient):
+        async def invoke_model_with_response_stream(self, **kwargs):
+            await asyncio.sleep(0.05)
+            return await super().invoke_model_with_response_stream(**kwargs)
+
+    fake = SlowAsyncClient()
+
+    # Each thread runs its own event loop; a task from one loop can't be awaited on another:
+    def ask():
+        return asyncio.run(call_bedrock_async("same moon?", fake))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert list(pool.map(lambda _: ask(), range(4))) == ["The Moon."] * 4
+    assert len(fake.bodies) == 4
+
+
+def test_hedger_sends_a_second_request_when_the_first_is_slow():
+    hedger = Hedger(min_samples=1, max_hedge_ratio=0.5)
+    hedger.latencies.extend([0.01] * 10)
+    replies = iter([("slow", 1.0), ("fast", 0.0)])
+
+    def call():
+        answer, wait = next(replies)
+        time.sleep(wait)
+        return answer
+
+    # The fast hedge answers long before the slow first attempt would have:
+    start = time.perf_counter()
+    assert hedger.call(call) == "fast"
+    assert time.perf_counter() - start < 0.5
+    assert hedger.metrics()["hedge_rate"] == 1.0
+    assert hedger.metrics()["hedge_wins"] == 1
+
+
+def test_hedger_uses_the_hedge_when_the_first_attempt_fails():
+    hedger = Hedger(min_samples=1, max_hedge_ratio=0.5)
+    hedger.latencies.extend([0.01] * 10)
+    calls = []
+
+    def call():
+        calls.append(threading.current_thread())
+        if len(calls) == 1:
+            time.sleep(0.1)
+            raise RuntimeError("throttled")
+        time.sleep(0.2)
+        return "hedged"
+
+    assert hedger.call(call) == "hedged"
+    # Neither attempt ran on the caller's thread, and only the hedge used the pool:
+    assert threading.current_thread() not in calls and calls[0].name == "hedge-first"
+
+
+def test_hedger_respects_the_hedge_cap():
+    hedger = Hedger(min_samples=1, max_hedge_ratio=0.0)
+    hedger.latencies.extend([0.01] * 10)
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.1)
+        return "slow"
+
+    assert hedger.call(slow_call) == "slow"
+    assert len(calls) == 1
+
+
+def test_region_pool_fails_over_and_prefers_the_fastest_region(fake_client, monkeypatch):
+    class ThrottledClient(FakeClient):
+        def answer_for(self, prompt):
+            raise throttled()
+
+    east, west = ThrottledClient(), FakeClient(answer="From the west.")
+    pool = RegionPool(["us-east-1", "us-west-2"], clients={"us-east-1": east, "us-west-2": west})
+    monkeypatch.setitem(bedrock_text_gen.region_pools, bedrock_text_gen.modelId, pool)
+
+    assert call_bedrock("moon?") == "From the west."
+    assert pool.ranked() == ["us-west-2", "us-east-1"]
+    assert pool.metrics()["us-east-1"]["healthy"] is False
+    assert pool.metrics()["us-west-2"]["error_rate"] == 0.0
+
+    # A bad request isn't the region's fault, so it isn't retried elsewhere:
+    def bad_request(client):
+        raise ClientError({"Error": {"Code": "ValidationException"}, "ResponseMetadata": {"HTTPStatusCode": 400}}, "InvokeModel")
+    with pytest.raises(ClientError):
+        pool.call(bad_request)
+
+
+def test_split_into_chunks_overlaps_and_stays_bounded():
+    words = [f"w{i:03d}" for i in range(200)]
+    chunks = list(split_into_chunks(w + " " for w in words))
+
+    assert len(chunks) == 1
+    chunks = list(split_into_chunks(" ".join(words), chunk_tokens=50, overlap_tokens=10))
+
+    assert len(chunks) > 3
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert chunks[0][-30:] in chunks[1]
+    assert chunks[-1].endswith("w199")
+
+
+def test_map_reduce_streams_partials_then_combines(fake_client):
+    class CountingClient(FakeClient):
+        def answer_for(self, prompt):
+            return "combined" if prompt.startswith("Combine") else f"part {prompt.count('w')}"
+
+    bedrock_text_gen.client = CountingClient()
+    document = " ".join(f"w{i:03d}" for i in range(200))
+    events = list(map_reduce_bedrock(document, chunk_tokens=50, overlap_tokens=10))
+
+    partials, final = events[:-1], events[-1]
+    assert sorted(event["chunk"] for event in partials) == list(range(final["chunks"]))
+    assert all(event["output"].startswith("part") for event in partials)
+    assert final["result"] == "combined"
+    assert final["sequential_seconds"] >= 0 and "saved_seconds" in final
+
+
+def test_map_reduce_bounds_concurrency_and_reports_time_saved(fake_client):
+    class SlowClient(FakeClient):
+        def __init__(self):
+            super().__init__()
+            self.lock = threading.Lock()
+            self.running = self.most = 0
+
+        def invoke_model_with_response_stream(self, **kwargs):
+            with self.lock:
+                self.running += 1
+                self.most = max(self.most, self.running)
+            time.sleep(0.05)
+            with self.lock:
+                self.running -= 1
+            return super().invoke_model_with_response_stream(**kwargs)
+
+        def answer_for(self, prompt):
+            return "combined" if prompt.startswith("Combine") else f"part {prompt.split()[-1]}"
+
+    slow = bedrock_text_gen.client = SlowClient()
+    document = " ".join(f"w{i:03d}" for i in range(400))
+    events = list(map_reduce_bedrock(document, max_concurrency=3, chunk_tokens=50, overlap_tokens=10))
+
+    final = events[-1]
+    assert final["chunks"] > 6
+    assert slow.most == 3
+    # Chunks overlapped, so they took less time than one after another:
+    assert final["map_seconds"] >= 0.05 * final["chunks"] / 3
+    assert final["sequential_seconds"] >= 0.05 * final["chunks"]
+    assert final["saved_seconds"] == pytest.approx(final["sequential_seconds"] - final["map_seconds"], abs=0.002)
+    assert final["saved_seconds"] > 0
+
+
+def test_map_reduce_finishes_when_partial_answers_do_not_fit_together(fake_client):
+    class WordyClient(FakeClient):
+        def answer_for(self, prompt):
+            return "summary " * 100
+
+    bedrock_text_gen.client = WordyClient()
+    document = " ".join(f"w{i:03d}" for i in range(200))
+    final = list(map_reduce_bedrock(document, chunk_tokens=50, overlap_tokens=10))[-1]
+
+    assert final["result"].startswith("summary")
+    # One call per chunk, then every reduce call combines at least two answers:
+    assert len(bedrock_text_gen.client.bodies) < 2 * final["chunks"]
+
+
+def test_semantic_cache_answers_reworded_prompts(fake_client, monkeypatch):
+    pytest.importorskip("numpy")
+    from bedrock_semantic_cache import SemanticCache, HashingEmbedder
+
+    monkeypatch.setattr(bedrock_text_gen, "semantic_cache", SemanticCache(HashingEmbedder(), threshold=0.8))
+
+    assert call_bedrock("What is the Earth's natural satellite called?") == "The Moon."
+    assert call_bedrock("what is the earth's natural satellite called") == "The Moon."
+    assert call_bedrock("Who painted the Mona Lisa?") == "The Moon."
+
+    assert len(fake_client.bodies) == 2
+    assert bedrock_text_gen.semantic_cache.stats() == {"hits": 1, "misses": 2, "entries": 2}
+
+
+def test_semantic_lookups_are_budgeted_and_retried(fake_client, monkeypatch):
+    pytest.importorskip("numpy")
+    from bedrock_semantic_cache import SemanticCache, HashingEmbedder
+
+    class ThrottledEmbedder(HashingEmbedder):
+        calls = 0
+
+        def embed(self, text):
+            self.calls += 1
+            if self.calls == 1:
+                raise ClientError({"Error": {"Code": "ThrottlingException"}}, "InvokeModel")
+            return super().embed(text)
+
+    embedder = ThrottledEmbedder()
+    monkeypatch.setattr(bedrock_text_gen, "semantic_cache", SemanticCache(embedder, threshold=0.8))
+    monkeypatch.setattr(bedrock_text_gen, "meter", Meter(budgets={"*": 1}))
+
+    assert call_bedrock("What is the Earth's natural satellite called?", caller="acme") == "The Moon."
+    assert embedder.calls == 2
+    with pytest.raises(BudgetExceeded):
+        call_bedrock("what is the earth's natural satellite called", caller="acme")
+    assert embedder.calls == 2
+
+
+def test_lambda_handler_reports_which_cache_answered(fake_client, monkeypatch):
+    pytest.importorskip("numpy")
+    from bedrock_semantic_cache import SemanticCache, HashingEmbedder
+
+    monkeypatch.setattr(bedrock_text_gen, "semantic_cache", SemanticCache(HashingEmbedder(), threshold=0.8))
+    ask = lambda prompt: bedrock_text_gen.lambda_handler({"queryStringParameters": {"prompt": prompt}}, None)["headers"]
+
+    assert ask("What is the Earth's natural satellite called?") == {"X-Cache": "MISS"}
+    assert ask("What is the Earth's natural satellite called?") == {"X-Cache": "HIT", "X-Cache-Match": "exact"}
+    assert ask("what is the earth's natural satellite called") == {"X-Cache": "HIT", "X-Cache-Match": "semantic"}
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    pytest.importorskip("numpy")
+    from bedrock_semantic_cache import SemanticCache, HashingEmbedder
+
+    cache = SemanticCache(HashingEmbedder(), threshold=0.99, max_entries=2)
+    first, second, third = (cache.embed(text) for text in ("alpha beta", "gamma delta", "epsilon zeta"))
+    cache.put(first, "1")
+    cache.put(second, "2")
+    assert cache.get(first) == "1"
+    cache.put(third, "3")
+
+    assert cache.get(second) is None
+    assert cache.get(first) == "1" and cache.get(third) == "3"
+
+
+def test_semantic_cache_hashing_finds_matches_at_the_threshold():
+    np = pytest.importorskip("numpy")
+    from bedrock_semantic_cache import SemanticCache
+
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((500, 128)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    cache = SemanticCache(embedder=None, max_entries=500, exact_below=0)
+    for i, vector in enumerate(vectors):
+        cache.put(vector, i)
+
+    # Queries just over the threshold from a cached vector: v*cos + (unit vector orthogonal to v)*sin
+    found = 0
+    for i, vector in enumerate(vectors):
+        noise = rng.standard_normal(128).astype(np.float32)
+        noise -= (noise @ vector) * vector
+        query = 0.925 * vector + np.sqrt(1 - 0.925 ** 2) * noise / np.linalg.norm(noise)
+        found += cache.get(query.astype(np.float32)) == i
+    assert found / len(vectors) > 0.97
+
+
+def test_run_bulk_writes_results_and_resumes_from_checkpoint(fake_client, tmp_path):
+    class EchoClient(FakeClient):
+        def answer_for(self, prompt):
+            if prompt == "bad":
+                raise ValueError("unanswerable")
+            return prompt.upper()
+
+    prompts = ["one", "two", "bad", "four", "five"]
+    source = tmp_path / "prompts.jsonl"
+    source.write_text("".join(json.dumps({"id": i, "prompt": p}) + "\n" for i, p in enumerate(prompts)))
+    offsets = [0]
+    for line in source.read_bytes().splitlines(keepends=True)[:-1]:
+        offsets.append(offsets[-1] + len(line))
+
+    # As if a previous run finished lines 0, 1 and 3 before stopping:
+    output = tmp_path / "results.jsonl"
+    (tmp_path / "results.jsonl.checkpoint").write_text(json.dumps({"watermark": offsets[2], "done": [offsets[3]]}))
+
+    summary = run_bulk(str(source), str(output), max_concurrency=2, bedrock_client=EchoClient())
+
+    results = {r["offset"]: r for r in map(json.loads, output.read_text().splitlines())}
+    assert summary == {"answered": 1, "failed": 1, "skipped": 1}
+    assert results[offsets[4]]["response"] == "FIVE" and results[offsets[4]]["id"] == 4
+    assert "unanswerable" in results[offsets[2]]["error"]
+    assert json.loads((tmp_path / "results.jsonl.checkpoint").read_text()) == {"watermark": source.stat().st_size, "done": []}
+
+    # Nothing left to do on a rerun:
+    assert run_bulk(str(source), str(output), bedrock_client=EchoClient()) == {"answered": 0, "failed": 0, "skipped": 0}
+
+
+# In-memory stand-ins for S3 and the Bedrock control plane.  Creating a job "runs" it straight
+# away, writing the output file the way Bedrock batch inference does.
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        data = self.objects[(Bucket, Key)]
+        return {"Body": StreamingBody(io.BytesIO(data), len(data))}
+
+
+class FakeBatchBedrock:
+    def __init__(self, s3):
+        self.s3 = s3
+        self.jobs = {}
+
+    def create_model_invocation_job(self, jobName, roleArn, modelId, inputDataConfig, outputDataConfig):
+        bucket, key = inputDataConfig["s3InputDataConfig"]["s3Uri"][5:].split("/", 1)
+        out_bucket, out_prefix = outputDataConfig["s3OutputDataConfig"]["s3Uri"][5:].split("/", 1)
+        arn = f"arn:aws:bedrock:us-east-1:123456789012:model-invocation-job/job{len(self.jobs)}"
+        lines = []
+        for line in self.s3.objects[(bucket, key)].decode().splitlines():
+            record = json.loads(line)
+            prompt = record["modelInput"]["inputText"]
+            if prompt == "bad":
+                record["error"] = {"errorCode": 400, "errorMessage": "bad prompt"}
+            else:
+                record["modelOutput"] = {"results": [{"outputText": prompt.upper()}]}
+            lines.append(json.dumps(record))
+        lines.reverse()
+        out_key = f"{out_prefix}job{len(self.jobs)}/{key.rsplit('/', 1)[-1]}.out"
+        self.s3.put_object(Bucket=out_bucket, Key=out_key, Body="\n".join(lines).encode())
+        self.jobs[arn] = "InProgress"
+        return {"jobArn": arn}
+
+    def get_model_invocation_job(self, jobIdentifier):
+        status = self.jobs[jobIdentifier]
+        self.jobs[jobIdentifier] = "Completed"
+        return {"status": status}
+
+
+def test_call_bedrock_batch_returns_answers_in_input_order():
+    s3 = FakeS3()
+    prompts = ["one", "two", "bad", "four", "five"]
+
+    results = list(call_bedrock_batch(prompts, "my-bucket", "arn:aws:iam::123456789012:role/batch",
+                                      records_per_job=2, min_records_per_job=1, s3=s3, bedrock=FakeBatchBedrock(s3),
+                                      sleep=lambda s: None))
+
+    assert results[:2] + results[3:] == ["ONE", "TWO", "FOUR", "FIVE"]
+    assert isinstance(results[2], RuntimeError) and "bad prompt" in str(results[2])
+    shards = [json.loads(line) for (bucket, key), body in s3.objects.items() if "/input/" in key
+              for line in body.decode().splitlines()]
+    assert len(shards) == 5
+    assert shards[0]["modelInput"] == bedrock_text_gen.build_body("one")
+
+
+def test_call_bedrock_batch_keeps_every_job_at_the_minimum_size():
+    def shard_sizes(count, **options):
+        s3 = FakeS3()
+        results = list(call_bedrock_batch([f"p{i}" for i in range(count)], "my-bucket", "arn:aws:iam::123456789012:role/batch",
+                                          s3=s3, bedrock=FakeBatchBedrock(s3), sleep=lambda s: None, **options))
+        assert results == [f"P{i}" for i in range(count)]
+        return [len(body.decode().splitlines()) for (bucket, key), body in sorted(s3.objects.items()) if "/input/" in key]
+
+    assert shard_sizes(530, records_per_job=250) == [250, 180, 100]
+    assert shard_sizes(330, records_per_job=150) == [150, 180]
+    assert shard_sizes(420, records_per_job=150) == [150, 150, 120]
+    assert shard_sizes(5) == [100]      # padded, and the padding's answers dropped
+    with pytest.raises(ValueError):
+        shard_sizes(5, records_per_job=2)
+
+
+def test_call_bedrock_batch_turns_a_failed_job_into_per_prompt_errors():
+    class FailingBatchBedrock(FakeBatchBedrock):
+        def get_model_invocation_job(self, jobIdentifier):
+            if jobIdentifier.endswith("job0"):
+                return {"status": "Failed", "message": "role can't read the bucket"}
+            return super().get_model_invocation_job(jobIdentifier)
+
+    s3 = FakeS3()
+    results = list(call_bedrock_batch(["one", "two", "three"], "my-bucket", "arn:aws:iam::123456789012:role/batch",
+                                      records_per_job=2, min_records_per_job=1, s3=s3,
+                                      bedrock=FailingBatchBedrock(s3), sleep=lambda s: None))
+
+    assert all(isinstance(result, RuntimeError) and "role can't read" in str(result) for result in results[:2])
+    assert results[2] == "THREE"
+
+
+def test_router_escalates_only_when_the_prompt_does_not_fit(fake_client):
+    short = choose_model("What is the capital of France?", response_tokens=100)[1]
+    medium = choose_model("word " * 5000, response_tokens=512)[1]
+    huge = choose_model("word " * 50_000, response_tokens=512)[1]
+
+    assert short["model_id"] == "amazon.titan-text-lite-v1" and short["max_tokens"] == 100
+    assert medium["model_id"] == "amazon.titan-text-express-v1"
+    assert huge["model_id"].startswith("anthropic.claude-3-haiku")
+
+    budgeted = choose_model("Tell me a long story.", response_tokens=2000, latency_budget=2.0)[1]
+    assert budgeted["model_id"] == "amazon.titan-text-lite-v1"
+    assert budgeted["max_tokens"] < 2000 and budgeted["reason"] == "capped to latency budget"
+
+
+def test_route_bedrock_uses_the_model_adapter_and_logs_the_decision(fake_client):
+    class ClaudeClient(FakeClient):
+        def invoke_model(self, **kwargs):
+            self.bodies.append(json.loads(kwargs["body"]))
+            self.model_id = kwargs["modelId"]
+            return {"body": io.BytesIO(json.dumps({"content": [{"type": "text", "text": "Paris."}]}).encode())}
+
+    claude = ClaudeClient()
+    assert route_bedrock("word " * 50_000, bedrock_client=claude) == "Paris."
+    assert claude.bodies[0]["messages"][0]["content"][0]["text"].startswith("word")
+    assert bedrock_router.decision_log[-1]["model_id"] == claude.model_id
+    assert bedrock_router.decision_log[-1]["cached"] is False
+
+    assert route_bedrock("Capital of France?", response_tokens=64) == "The Moon."
+    assert fake_client.bodies[-1]["textGenerationConfig"]["maxTokenCount"] == 64
+
+
+def test_converse_marks_the_prefix_for_caching_and_reports_cached_tokens(fake_client):
+    class ConverseClient(FakeClient):
+        def converse(self, **kwargs):
+            self.bodies.append(kwargs)
+            return {
+                "output": {"message": {"role": "assistant", "content": [{"text": "Paris."}]}},
+                "usage": {"inputTokens": 12, "outputTokens": 3, "cacheReadInputTokens": 1500, "cacheWriteInputTokens": 0},
+            }
+
+    converse = ConverseClient()
+    result = converse_bedrock("Capital of France?", "You are a geography tutor. " * 200,
+                              model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0", bedrock_client=converse)
+
+    assert result == {"text": "Paris.", "api": "converse",
+                      "usage": {"input_tokens": 12, "cache_read_tokens": 1500, "cache_write_tokens": 0, "output_tokens": 3}}
+    assert converse.bodies[0]["system"][1] == {"cachePoint": {"type": "default"}}
+
+    converse_bedrock("Capital of Spain?", "Be brief.", model_id="anthropic.claude-3-haiku-20240307-v1:0", bedrock_client=converse)
+    assert len(converse.bodies[1]["system"]) == 1
+
+
+def test_converse_falls_back_to_invoke_model_for_titan(fake_client):
+    calls = []
+    original = fake_client.invoke_model_with_response_stream
+    fake_client.invoke_model_with_response_stream = lambda **kwargs: calls.append(kwargs) or original(**kwargs)
+    result = converse_bedrock("Capital of France?", "Be brief.", model_id="amazon.titan-text-express-v1", max_tokens=64)
+
+    assert result == {"text": "The Moon.", "api": "invoke_model",
+                      "usage": {"input_tokens": 5, "cache_read_tokens": 0, "cache_write_tokens": 0, "output_tokens": 2}}
+    assert calls[0]["modelId"] == "amazon.titan-text-express-v1"
+    assert fake_client.bodies[0]["inputText"] == "Be brief.\n\nCapital of France?"
+    assert fake_client.bodies[0]["textGenerationConfig"]["maxTokenCount"] == 64
+
+
+# The emulator speaks the real wire protocol, so these go through botocore's own parsing:
+@pytest.fixture()
+def emulator(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "emulator")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "emulator")
+    server = start_emulator(settings=EmulatorSettings(latency_median=0, chunk_delay=0, answers={"satellite": "The Moon."}))
+    yield server
+    server.shutdown()
+
+
+def emulator_client(server):
+    return boto3.client("bedrock-runtime", endpoint_url=server.url, config=Config(retries={"total_max_attempts": 1}))
+
+
+def test_emulator_streams_text_and_returns_images(emulator):
+    client = emulator_client(emulator)
+
+    assert "".join(stream_bedrock("What is the earth's natural satellite called?", client)) == "The Moon."
+    assert bedrock_text_gen.generate("Tell me a joke", client) == "This is a canned answer from the local Bedrock emulator."
+
+    image = client.invoke_model(modelId="amazon.titan-image-generator-v1",
+                                body=json.dumps({"imageGenerationConfig": {"width": 64, "height": 32}}))
+    png = base64.b64decode(json.loads(image["body"].read())["images"][0])
+    assert png.startswith(b"\x89PNG") and png[16:24] == (64).to_bytes(4, "big") + (32).to_bytes(4, "big")
+
+
+def test_emulator_injects_throttling(emulator):
+    emulator.settings.throttle_rate = 1.0
+
+    with pytest.raises(ClientError) as error:
+        emulator_client(emulator).invoke_model(modelId=bedrock_text_gen.modelId, body=json.dumps({"inputText": "hi"}))
+
+    assert error.value.response["Error"]["Code"] == "ThrottlingException"
+    assert emulator.settings.throttled == 1
+
+
+def test_meter_records_model_calls_per_caller_and_flushes_deltas(fake_client, monkeypatch, tmp_path):
+    meter = Meter(FileSink(tmp_path / "usage.jsonl"), flush_seconds=3600)
+    monkeypatch.setattr(bedrock_text_gen, "meter", meter)
+
+    call_bedrock("name the moon", caller="acme", route="/text")
+    call_bedrock("name the sun", caller="acme", route="/text")
+    call_bedrock("name the moon", caller="acme", route="/text")   # cached, so not metered
+    call_bedrock("name the moon please", route="/text")
+
+    rows = {row["caller"]: row for row in meter.flush()}
+    assert rows["acme"]["calls"] == 2
+    assert rows["acme"]["input_tokens"] == 6 and rows["acme"]["output_tokens"] == 4
+    assert rows["anonymous"]["calls"] == 1
+    assert meter.flush() == []
+
+    written = [json.loads(line) for line in open(tmp_path / "usage.jsonl")]
+    assert sorted(row["caller"] for row in written) == ["acme", "anonymous"]
+
+
+def test_budget_stops_new_calls_but_not_cache_hits(fake_client, monkeypatch):
+    now = [0.0]
+    meter = Meter(budgets={"*": 10}, budget_window=60, clock=lambda: now[0])
+    monkeypatch.setattr(bedrock_text_gen, "meter", meter)
+
+    call_bedrock("one two three four", caller="acme")       # 4 + 2 tokens
+    call_bedrock("five six", caller="acme")                 # 2 + 2 tokens
+    with pytest.raises(BudgetExceeded):
+        call_bedrock("seven", caller="acme")
+    assert call_bedrock("five six", caller="acme") == "The Moon."
+    call_bedrock("seven", caller="globex")
+
+    now[0] = 61.0
+    assert meter.used("acme") == 0
+    call_bedrock("seven", caller="acme")
+
+
+def test_router_converse_and_async_calls_are_metered_too(fake_client, monkeypatch):
+    meter = Meter(budgets={"*": 1560}, budget_window=60)
+    monkeypatch.setattr(bedrock_text_gen, "meter", meter)
+
+    class ConverseClient(FakeClient):
+        def converse(self, **kwargs):
+            return {
+                "output": {"message": {"role": "assistant", "content": [{"text": "Paris."}]}},
+                "usage": {"inputTokens": 12, "outputTokens": 3, "cacheReadInputTokens": 1500, "cacheWriteInputTokens": 0},
+            }
+
+    class ClaudeClient(FakeClient):
+        def invoke_model(self, **kwargs):
+            body = {"content": [{"type": "text", "text": "Paris."}], "usage": {"input_tokens": 40, "output_tokens": 2}}
+            return {"body": io.BytesIO(json.dumps(body).encode())}
+
+    route_bedrock("word " * 50_000, bedrock_client=ClaudeClient(), caller="acme", route="/route")
+    converse_bedrock("Capital of France?", "Be brief.", model_id="anthropic.claude-3-haiku-20240307-v1:0",
+                     bedrock_client=ConverseClient(), caller="acme", route="/converse")
+    asyncio.run(call_bedrock_async("name the moon", FakeAsyncClient(), caller="acme", route="/async"))
+
+    rows = {row["route"]: row for row in meter.flush()}
+    assert (rows["/route"]["input_tokens"], rows["/route"]["output_tokens"]) == (40, 2)
+    assert rows["/converse"]["cache_read_tokens"] == 1500 and rows["/converse"]["output_tokens"] == 3
+    assert (rows["/async"]["input_tokens"], rows["/async"]["output_tokens"]) == (3, 2)
+    assert meter.used("acme") == 40 + 2 + 12 + 3 + 1500 + 3 + 2
+    with pytest.raises(BudgetExceeded):
+        converse_bedrock("Capital of Spain?", "Be brief.", model_id="anthropic.claude-3-haiku-20240307-v1:0",
+                         bedrock_client=ConverseClient(), caller="acme")
+
+
+def test_meter_counts_every_thread_and_writes_emf(capsys):
+    meter = Meter(EmfSink(namespace="Test"))
+
+    def work(_):
+        for _ in range(1000):
+            meter.record("acme", "/text", "titan", 3, 2, 0.001)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+    meter.flush()
+
+    record = json.loads(capsys.readouterr().out)
+    assert record["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "Test"
+    assert (record["Caller"], record["Calls"], record["InputTokens"], record["OutputTokens"]) == ("acme", 8000, 24000, 16000)
+    assert meter.top(1)[0]["tokens_per_call"] == 5.0
+
+
+def test_meter_folds_in_threads_that_have_exited():
+    meter = Meter()
+
+    for _ in range(50):
+        thread = threading.Thread(target=meter.record, args=("acme", "/text", "titan", 3, 2, 0.001))
+        thread.start()
+        thread.join()
+    meter.record("acme", "/text", "titan", 3, 2, 0.001)
+
+    assert len(meter.shards) == 1
+    assert meter.totals()[("acme", "/text", "titan")][:3] == [51, 153, 102]
+    assert meter.used("acme") == 255